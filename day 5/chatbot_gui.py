@@ -11,54 +11,127 @@ GigaChat AI - Агент-архитектор данных для проекти
 """
 
 import os
+import re
+import sys
 import json
+import time
+import queue
+import hashlib
+import importlib.util
 import tkinter as tk
 from tkinter import scrolledtext, messagebox
-from threading import Thread
+from threading import Thread, Lock, Condition
 from datetime import datetime
-from dotenv import load_dotenv
-from gigachat import GigaChat
-from gigachat.models import Chat, Messages, MessagesRole
-from collections import OrderedDict
+from collections import OrderedDict, deque
 
-# Загружаем переменные окружения
-load_dotenv()
+try:
+    import numpy as np
+except ImportError:  # Семантический кеш необязателен
+    np = None
+
+try:
+    import orjson
+except ImportError:  # Без orjson файлы пресетов разбираются модулем json
+    orjson = None
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 CONFIG_DIR = os.path.join(BASE_DIR, "config")
 PROMPTS_FILE_PATH = os.path.join(CONFIG_DIR, "preset_prompts.json")
 PROMPT_NAMES_FILE_PATH = os.path.join(CONFIG_DIR, "preset_prompt_names.json")
 
-DEFAULT_PRESET_PROMPTS = OrderedDict({
+DEFAULT_PRESET_PROMPTS = {
     "no_settings": "Ты — полезный AI-ассистент. Помогай пользователю решать его задачи максимально эффективно."
-})
+}
 
-DEFAULT_PRESET_NAMES = OrderedDict({
+DEFAULT_PRESET_NAMES = {
     "no_settings": "Без настроек"
-})
+}
 
 DEFAULT_PRESET_KEY = "no_settings"
 
 # Температура по умолчанию
 DEFAULT_TEMPERATURE = 0.6
 
+# Универсальное приветственное сообщение, которое не навязывает роль
+GREETING_MESSAGE = sys.intern("Привет! Представься и начни диалог.")
+
+# Признаки технического задания в ответе агента
+TZ_KEYWORDS = ("техническое задание", "тз", "проект:", "цели:", "источники данных:")
+TZ_KEYWORDS_RE = re.compile("|".join(map(re.escape, TZ_KEYWORDS)), re.IGNORECASE)
+TZ_CONFIRM_RE = re.compile(re.escape("спасибо за ответы"), re.IGNORECASE)
+
+# Максимальное число ответов в локальном кеше
+RESPONSE_CACHE_SIZE = 128
+
+# Семантический кеш: размер, порог косинусной близости и пресеты без состояния
+SEMANTIC_CACHE_SIZE = 256
+SEMANTIC_CACHE_THRESHOLD = 0.93
+STATELESS_PRESET_KEYS = {"no_settings"}
+
+# Пул HTTP-соединений к GigaChat: держим keep-alive между ходами диалога
+HTTP_LIMITS = {"max_keepalive_connections": 8, "max_connections": 16, "keepalive_expiry": 60.0}
+HTTP_TIMEOUT = {"connect": 5.0, "read": 60.0, "write": 10.0, "pool": 5.0}
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# Сжатие истории: порог длины, число сохраняемых последних сообщений
+HISTORY_COMPACT_THRESHOLD = 22
+HISTORY_KEEP_MESSAGES = 10
+# Жесткий лимит истории (вместе с системным промптом), если резюме получить не удалось
+HISTORY_MAX_MESSAGES = 24
+HISTORY_SUMMARY_PROMPT = (
+    "Сожми фрагмент диалога пользователя с агентом-архитектором данных в краткое резюме. "
+    "Сохрани все факты о проекте, требования, ответы пользователя и принятые решения. "
+    "Отвечай только текстом резюме."
+)
+
+# Окно (мс), в течение которого сообщения пользователя объединяются в один запрос
+SEND_DEBOUNCE_MS = 200
+
+# Период (мс) опроса очереди обновлений интерфейса от фонового потока
+UI_POLL_MS = 30
+
+# Период (мс) вывода накопленного текста в окно чата
+RENDER_INTERVAL_MS = 40
+
+# Подпись ответов агента в окне чата
+BOT_LABEL = "Архитектор: "
+
+# Ограничение частоты запросов к GigaChat: токенов в секунду и размер всплеска
+RATE_LIMIT_PER_SECOND = 0.5
+RATE_LIMIT_BURST = 2
+
 
-def load_json_mapping(file_path: str) -> OrderedDict:
-    if not os.path.exists(file_path):
-        return OrderedDict()
+# Разобранные JSON-файлы: путь -> ((mtime, размер), данные)
+# (dict сохраняет порядок ключей из файла)
+_preset_cache = {}
+
+
+def load_json_mapping(file_path: str) -> dict:
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return {}
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _preset_cache.get(file_path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    mapping = {}
     try:
-        with open(file_path, "r", encoding="utf-8") as file:
-            data = json.load(file)
-            if isinstance(data, dict):
-                return OrderedDict(data)
+        with open(file_path, "rb") as file:
+            raw = file.read()
+        data = orjson.loads(raw) if orjson is not None else json.loads(raw)
+        if isinstance(data, dict):
+            mapping = data
     except Exception:
         pass
-    return OrderedDict()
+    _preset_cache[file_path] = (signature, mapping)
+    return mapping
 
 
-def load_preset_definitions() -> OrderedDict:
-    prompts = OrderedDict(DEFAULT_PRESET_PROMPTS)
-    prompt_names = OrderedDict(DEFAULT_PRESET_NAMES)
+def load_preset_definitions() -> dict:
+    prompts = DEFAULT_PRESET_PROMPTS
+    prompt_names = DEFAULT_PRESET_NAMES
 
     file_prompts = load_json_mapping(PROMPTS_FILE_PATH)
     file_names = load_json_mapping(PROMPT_NAMES_FILE_PATH)
@@ -69,7 +142,7 @@ def load_preset_definitions() -> OrderedDict:
         prompt_names = file_names
 
     available_keys = [key for key in prompt_names if key in prompts]
-    presets = OrderedDict()
+    presets = {}
     for key in available_keys:
         presets[key] = {
             "name": prompt_names[key],
@@ -79,6 +152,42 @@ def load_preset_definitions() -> OrderedDict:
     return presets
 
 
+def construct_model(model_cls, **fields):
+    """Создание модели gigachat без валидации (поля заполняются проверенными данными)"""
+    construct = getattr(model_cls, "model_construct", None) or model_cls.construct
+    return construct(**fields)
+
+
+def default_preset_definitions() -> dict:
+    return {
+        key: {"name": name, "prompt": DEFAULT_PRESET_PROMPTS[key]}
+        for key, name in DEFAULT_PRESET_NAMES.items()
+        if key in DEFAULT_PRESET_PROMPTS
+    }
+
+
+class _TokenBucket:
+    """Ограничитель частоты запросов: блокирует вызывающий поток, пока нет токена"""
+    
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._cond = Condition()
+    
+    def acquire(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                self._cond.wait((1 - self._tokens) / self.rate)
+
+
 class ChatBotGUI:
     def __init__(self, root):
         self.root = root
@@ -87,111 +196,363 @@ class ChatBotGUI:
         self.root.configure(bg="#0066cc")
         self.configure_mac_integration()
         
-        # Загрузка доступных пресетов (названия и промпты)
-        self.presets = load_preset_definitions()
-        if not self.presets:
-            messagebox.showwarning(
-                "Предустановки недоступны",
-                "Не удалось загрузить предустановленные промпты. "
-                "Будет использован промпт по умолчанию."
-            )
-            self.presets = OrderedDict({
-                key: {"name": name, "prompt": DEFAULT_PRESET_PROMPTS[key]}
-                for key, name in DEFAULT_PRESET_NAMES.items()
-                if key in DEFAULT_PRESET_PROMPTS
-            })
-        self.current_preset_key = DEFAULT_PRESET_KEY if DEFAULT_PRESET_KEY in self.presets else next(iter(self.presets))
+        # Пресеты по умолчанию; пресеты из файлов подгружаются в фоне
+        self.presets = default_preset_definitions()
+        self._presets_loaded = False
+        self._gigachat_ready = False
+        self.select_default_preset()
         
         # История диалога для контекста
         self.conversation_history = []
         
-        # Текущий промпт
-        self.current_prompt = self.presets[self.current_preset_key]["prompt"]
-        self.current_prompt_name = self.presets[self.current_preset_key]["name"]
-        
         # Текущая модель (по умолчанию GigaChat Lite)
         self.current_model = "GigaChat"  # GigaChat Lite по умолчанию
         
         # Температура выборки для генерации ответов
         self.temperature = DEFAULT_TEMPERATURE
         
-        # Флаги запросов к GigaChat (отключаем кеширование ответов)
-        self.request_flags = ["no_cache"]
+        # Флаги запросов к GigaChat. По умолчанию серверный кеш префикса включен:
+        # системный промпт и история повторяются в каждом запросе без изменений.
+        # "no_cache" добавляется только в режиме разработчика.
+        self.dev_mode = False
+        self.request_flags = []
+        
+        # Локальный LRU-кеш ответов для одинаковых состояний диалога
+        self.response_cache_enabled = True
+        self._response_cache = OrderedDict()
+        self._response_cache_lock = Lock()
+        
+        # Семантический кеш: эмбеддинг вопроса -> ответ (для похожих формулировок)
+        self.semantic_cache_enabled = False
+        self._semantic_cache = deque(maxlen=SEMANTIC_CACHE_SIZE)
+        self._embedding_cache = OrderedDict()
         
-        # Инициализация GigaChat клиента
+        # Ограничение частоты запросов (ожидает фоновый поток, а не интерфейс)
+        self._bucket = _TokenBucket(rate=RATE_LIMIT_PER_SECOND, capacity=RATE_LIMIT_BURST)
+        
+        # Выводится ли сейчас потоковый ответ
+        self._stream_active = False
+        
+        # Буфер вставок в окно чата (выводится пачкой раз в RENDER_INTERVAL_MS)
+        self._render_buf = []
+        self._render_scheduled = False
+        
+        # Запрос на приветствие (создается при первом обращении)
+        self._greeting_request = None
+        
+        # Сообщения, ожидающие отправки, и идентификатор отложенной отправки
+        self._pending = []
+        self._debounce_id = None
+        
+        # Фоновый поток, последовательно выполняющий запросы к GigaChat
+        self._jobs = queue.Queue()
+        self._worker = Thread(target=self._worker_loop, daemon=True)
+        self._worker.start()
+        
+        # Обновления интерфейса из фонового потока (разбираются в главном потоке)
+        self._ui_events = queue.Queue()
+        
+        # Подключение к GigaChat (импорт SDK, TLS-соединение, токен) и чтение
+        # файлов пресетов идут в фоновых потоках параллельно с построением окна
         self.giga_client = None
-        self.init_gigachat()
+        self.submit_job(self.start_gigachat)
+        Thread(target=self._load_presets_async, daemon=True).start()
         
         # Создание интерфейса
         self.create_widgets()
-        
-        # Инициализация диалога с системным промптом
+        self.root.after(UI_POLL_MS, self._drain_ui_events)
+    
+    def _worker_loop(self):
+        """Выполнение заданий из очереди (None — сигнал остановки)"""
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            target, args = job
+            target(*args)
+    
+    def submit_job(self, target, *args):
+        """Постановка запроса в очередь фонового потока"""
+        self._jobs.put((target, args))
+    
+    def post_ui(self, callback, *args):
+        """Передача обновления интерфейса из фонового потока без обращения к Tcl"""
+        self._ui_events.put((callback, args))
+    
+    def _drain_ui_events(self):
+        """Применение всех накопившихся обновлений интерфейса за один тик"""
+        try:
+            while True:
+                try:
+                    callback, args = self._ui_events.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    callback(*args)
+                except Exception:
+                    # Ошибка одного обновления не должна останавливать остальные
+                    self.root.report_callback_exception(*sys.exc_info())
+        finally:
+            # Опрос очереди продолжается при любой ошибке, иначе интерфейс перестанет обновляться
+            self.root.after(UI_POLL_MS, self._drain_ui_events)
+    
+    def start_gigachat(self):
+        """Подключение к GigaChat и прогрев соединения (выполняется в фоновом потоке)"""
+        error = self.init_gigachat()
         if self.giga_client:
-            self.initialize_conversation()
+            self._warm_up_connection()
+        self.post_ui(self._on_gigachat_ready, error)
+    
+    def _warm_up_connection(self):
+        """Получение токена и установка соединения до первого запроса"""
+        try:
+            self.giga_client.get_models()
+        except Exception:
+            # Прогрев необязателен: первый запрос сам установит соединение
+            pass
+    
+    def _on_gigachat_ready(self, error):
+        """Запуск диалога после подключения к GigaChat"""
+        if error:
+            messagebox.showerror(*error)
+        
+        if not self.giga_client:
+            self.add_message("error", "Ошибка: не удалось подключиться к GigaChat API")
+            return
+        
+        self._gigachat_ready = True
+        self._maybe_start_conversation()
+    
+    def _load_presets_async(self):
+        """Чтение файлов пресетов (выполняется в фоновом потоке)"""
+        self.post_ui(self._apply_loaded_presets, load_preset_definitions())
+    
+    def _apply_loaded_presets(self, presets):
+        """Применение пресетов из файлов"""
+        if presets:
+            self.presets = presets
+        else:
+            messagebox.showwarning(
+                "Предустановки недоступны",
+                "Не удалось загрузить предустановленные промпты. "
+                "Будет использован промпт по умолчанию."
+            )
+        self.select_default_preset()
+        self.update_info_label()
+        self.settings_button.config(state=tk.NORMAL)
+        
+        self._presets_loaded = True
+        self._maybe_start_conversation()
+    
+    def _maybe_start_conversation(self):
+        """Запуск диалога, когда загружены пресеты и подключен клиент"""
+        if not (self._presets_loaded and self._gigachat_ready):
+            return
+        
+        self.send_button.config(state=tk.NORMAL)
         
+        # Инициализация диалога с системным промптом
+        self.initialize_conversation()
+    
+    def select_default_preset(self):
+        """Выбор пресета по умолчанию (или первого доступного)"""
+        self.current_preset_key = DEFAULT_PRESET_KEY if DEFAULT_PRESET_KEY in self.presets else next(iter(self.presets))
+        self.current_prompt = self.presets[self.current_preset_key]["prompt"]
+        self.current_prompt_name = self.presets[self.current_preset_key]["name"]
+    
+    def update_info_label(self):
+        """Обновление информационной панели"""
+        model_display = "Pro" if self.current_model == "GigaChat-Pro" else "Lite"
+        self.info_label.config(text=f"Режим: {self.current_prompt_name} | Модель: {model_display} | Температура: {self.temperature:.2f}")
+    
     def init_gigachat(self):
-        """Инициализация GigaChat клиента"""
+        """Инициализация GigaChat клиента.
+        
+        Возвращает заголовок и текст ошибки для показа пользователю или None.
+        """
+        from dotenv import load_dotenv
+        from gigachat import GigaChat
+        
+        # Загружаем переменные окружения
+        load_dotenv()
+        
         credentials = os.getenv("GIGACHAT_CREDENTIALS")
         
         if not credentials:
-            messagebox.showerror(
+            return (
                 "Ошибка", 
                 "Не найден GIGACHAT_CREDENTIALS в переменных окружения.\n\n"
                 "Создайте файл .env в корне проекта со следующим содержимым:\n"
                 "GIGACHAT_CREDENTIALS=ваш_ключ_авторизации"
             )
-            return
         
         try:
             self.giga_client = GigaChat(
                 credentials=credentials, 
                 verify_ssl_certs=False
             )
+            self.use_pooled_http_client()
             self.giga_client.__enter__()
         except Exception as e:
-            messagebox.showerror("Ошибка подключения", f"Не удалось подключиться к GigaChat API:\n{e}")
             self.giga_client = None
+            return ("Ошибка подключения", f"Не удалось подключиться к GigaChat API:\n{e}")
+        return None
+    
+    def use_pooled_http_client(self):
+        """Подмена HTTP-клиента SDK на клиент с настроенным пулом keep-alive соединений"""
+        import httpx
+        
+        settings = getattr(self.giga_client, "_settings", None)
+        if settings is None:
+            return
+        http_client = httpx.Client(
+            base_url=settings.base_url,
+            verify=False,
+            limits=httpx.Limits(**HTTP_LIMITS),
+            timeout=httpx.Timeout(**HTTP_TIMEOUT),
+            http2=HTTP2_AVAILABLE
+        )
+        try:
+            self.giga_client._client = http_client
+        except AttributeError:
+            # Другая версия SDK: остаемся на клиенте по умолчанию
+            http_client.close()
     
     def initialize_conversation(self):
         """Инициализация диалога с системным промптом"""
+        from gigachat.models import Messages, MessagesRole
+        
         # Добавляем системное сообщение в историю
         self.conversation_history = [
-            Messages(role=MessagesRole.SYSTEM, content=self.current_prompt)
+            construct_model(Messages, role=MessagesRole.SYSTEM, content=self.current_prompt)
         ]
         
         # Отправляем приветственное сообщение от агента
-        Thread(target=self.get_initial_greeting, daemon=True).start()
+        self.submit_job(self.get_initial_greeting)
     
     def get_initial_greeting(self):
         """Получение приветственного сообщения от агента"""
+        from gigachat.models import Messages, MessagesRole
+        
         try:
-            # Универсальное приветственное сообщение, которое не навязывает роль
-            greeting_message = "Привет! Представься и начни диалог."
+            # Запрос на приветствие не меняется, поэтому создаем его один раз
+            if self._greeting_request is None:
+                self._greeting_request = construct_model(Messages, role=MessagesRole.USER, content=GREETING_MESSAGE)
             
             # Создаем чат с системным промптом и запросом на приветствие
-            messages = self.conversation_history + [
-                Messages(role=MessagesRole.USER, content=greeting_message)
-            ]
-            chat = Chat(
-                messages=messages,
-                model=self.current_model,
-                temperature=self.temperature,
-                flags=self.request_flags
-            )
-            
-            response = self.giga_client.chat(chat)
-            greeting = response.choices[0].message.content
+            messages = [*self.conversation_history, self._greeting_request]
+            greeting = self.request_completion("greeting", messages)
             
             # Обновляем историю
-            self.conversation_history.append(Messages(role=MessagesRole.USER, content=greeting_message))
-            self.conversation_history.append(Messages(role=MessagesRole.ASSISTANT, content=greeting))
+            self.conversation_history.append(self._greeting_request)
+            self.conversation_history.append(construct_model(Messages, role=MessagesRole.ASSISTANT, content=greeting))
             
             # Обновляем UI в главном потоке
-            self.root.after(0, lambda: self.display_response(greeting))
+            self.post_ui(self._finish, "bot", greeting)
             
         except Exception as e:
             error_msg = f"Ошибка при инициализации: {str(e)}"
-            self.root.after(0, lambda: self.display_error(error_msg))
+            self.post_ui(self._finish, "error", error_msg)
+    
+    def _response_cache_key(self, kind, messages):
+        """Ключ кеша: тип запроса, модель, температура и вся история сообщений"""
+        payload = json.dumps(
+            [kind, self.current_model, self.temperature]
+            + [(message.role, message.content) for message in messages],
+            ensure_ascii=False
+        )
+        return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).digest()
+    
+    def request_completion(self, kind, messages, on_chunk=None):
+        """Запрос к GigaChat с проверкой локального кеша ответов.
+        
+        Если передан on_chunk, ответ запрашивается в потоковом режиме
+        и передается в него частями по мере генерации.
+        """
+        from gigachat.models import Chat
+        
+        cache_key = None
+        cached = None
+        if self.response_cache_enabled:
+            cache_key = self._response_cache_key(kind, messages)
+            with self._response_cache_lock:
+                cached = self._response_cache.get(cache_key)
+                if cached is not None:
+                    self._response_cache.move_to_end(cache_key)
+        if cached is not None:
+            if on_chunk is not None:
+                on_chunk(cached)
+            return cached
+        
+        chat = construct_model(
+            Chat,
+            messages=messages,
+            model=self.current_model,
+            temperature=self.temperature,
+            flags=self.request_flags
+        )
+        self._bucket.acquire()
+        if on_chunk is None:
+            response = self.giga_client.chat(chat)
+            content = response.choices[0].message.content
+        else:
+            parts = []
+            for chunk in self.giga_client.stream(chat):
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    on_chunk(delta)
+            content = "".join(parts)
+        
+        if cache_key is not None:
+            with self._response_cache_lock:
+                self._response_cache[cache_key] = content
+                if len(self._response_cache) > RESPONSE_CACHE_SIZE:
+                    self._response_cache.popitem(last=False)
+        return content
+    
+    def _semantic_query_vector(self, text):
+        """Нормированный эмбеддинг вопроса или None, если семантический кеш неприменим"""
+        if np is None or not self.semantic_cache_enabled:
+            return None
+        # Для пресетов с состоянием ответ зависит от хода диалога, а не только от вопроса
+        if self.current_preset_key not in STATELESS_PRESET_KEYS:
+            return None
+        
+        with self._response_cache_lock:
+            vector = self._embedding_cache.get(text)
+        if vector is not None:
+            return vector
+        
+        try:
+            response = self.giga_client.embeddings(texts=[text])
+        except Exception:
+            return None
+        vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if not norm:
+            return None
+        vector /= norm
+        
+        with self._response_cache_lock:
+            self._embedding_cache[text] = vector
+            if len(self._embedding_cache) > SEMANTIC_CACHE_SIZE:
+                self._embedding_cache.popitem(last=False)
+        return vector
+    
+    def _semantic_lookup(self, query_vector):
+        """Поиск ответа на близкий по смыслу вопрос (косинусная близость)"""
+        with self._response_cache_lock:
+            entries = list(self._semantic_cache)
+        if not entries:
+            return None
+        
+        matrix = np.stack([vector for vector, _ in entries])
+        similarities = matrix @ query_vector
+        best = int(np.argmax(similarities))
+        if similarities[best] >= SEMANTIC_CACHE_THRESHOLD:
+            return entries[best][1]
+        return None
     
     def create_widgets(self):
         """Создание элементов интерфейса"""
@@ -210,8 +571,8 @@ class ChatBotGUI:
         )
         title_label.pack(side=tk.LEFT, padx=20)
         
-        # Кнопка настроек
-        settings_button = tk.Button(
+        # Кнопка настроек (активируется после загрузки пресетов)
+        self.settings_button = tk.Button(
             header_frame,
             text="⚙️ Настройки",
             command=self.open_settings,
@@ -221,15 +582,14 @@ class ChatBotGUI:
             activebackground="#e0e0e0",
             padx=10,
             pady=5,
-            relief=tk.RAISED
+            relief=tk.RAISED,
+            state=tk.DISABLED
         )
-        settings_button.pack(side=tk.RIGHT, padx=20, pady=10)
+        self.settings_button.pack(side=tk.RIGHT, padx=20, pady=10)
         
         # Информационная панель
-        model_display = "Pro" if self.current_model == "GigaChat-Pro" else "Lite"
         info_label = tk.Label(
             self.root,
-            text=f"Режим: {self.current_prompt_name} | Модель: {model_display} | Температура: {self.temperature:.2f}",
             font=("Arial", 9, "italic"),
             bg="#0066cc",
             fg="#e0e0e0",
@@ -237,6 +597,7 @@ class ChatBotGUI:
         )
         info_label.pack(fill=tk.X)
         self.info_label = info_label  # Сохраняем ссылку для обновления
+        self.update_info_label()
         
         # Область с ответами бота
         self.chat_display = scrolledtext.ScrolledText(
@@ -260,10 +621,6 @@ class ChatBotGUI:
         self.chat_display.tag_config("error_tag", foreground="#dc3545", font=("Arial", 11, "bold"))
         self.chat_display.tag_config("tz_tag", foreground="#6f42c1", font=("Arial", 11, "bold"))
         
-        # Приветственное сообщение (если клиент не инициализирован)
-        if not self.giga_client:
-            self.add_message("error", "Ошибка: не удалось подключиться к GigaChat API")
-        
         # Фрейм для ввода
         input_frame = tk.Frame(self.root, bg="#0066cc")
         input_frame.pack(fill=tk.X, padx=10, pady=5)
@@ -301,7 +658,7 @@ class ChatBotGUI:
             relief=tk.RAISED,
             borderwidth=2,
             cursor="hand2",
-            state=tk.DISABLED if not self.giga_client else tk.NORMAL
+            state=tk.DISABLED  # Активируется после подключения к GigaChat
         )
         self.send_button.pack(side=tk.RIGHT)
         
@@ -317,24 +674,59 @@ class ChatBotGUI:
         """Добавление сообщения в чат"""
         # Время
         time_str = datetime.now().strftime("%H:%M")
-        self.chat_display.configure(state=tk.NORMAL)
-        self.chat_display.insert(tk.END, f"[{time_str}] ")
+        self.queue_render(f"[{time_str}] ")
         
         # Отправитель
         if sender == "user":
-            self.chat_display.insert(tk.END, "Вы: ", "user_tag")
+            self.queue_render("Вы: ", "user_tag")
         elif sender == "bot":
-            self.chat_display.insert(tk.END, "Архитектор: ", "bot_tag")
+            self.queue_render(BOT_LABEL, "bot_tag")
         elif sender == "error":
-            self.chat_display.insert(tk.END, "Ошибка: ", "error_tag")
+            self.queue_render("Ошибка: ", "error_tag")
         elif sender == "tz":
-            self.chat_display.insert(tk.END, "📋 ТЗ: ", "tz_tag")
+            self.queue_render("📋 ТЗ: ", "tz_tag")
         
         # Сообщение
-        self.chat_display.insert(tk.END, f"{message}\n\n")
+        self.queue_render(f"{message}\n\n")
+    
+    def queue_render(self, text, tag=None):
+        """Отложенная вставка текста в чат: вставки копятся и выводятся одной пачкой"""
+        self._render_buf.append((text, tag))
+        if not self._render_scheduled:
+            self._render_scheduled = True
+            self.root.after(RENDER_INTERVAL_MS, self._flush_render)
+    
+    def _flush_render(self):
+        """Вывод накопленного текста в чат за один цикл NORMAL/DISABLED"""
+        self._render_scheduled = False
+        if not self._render_buf:
+            return
+        buf, self._render_buf = self._render_buf, []
         
+        self.chat_display.configure(state=tk.NORMAL)
+        run_text, run_tag = [], buf[0][1]
+        for text, tag in buf:
+            if tag != run_tag:
+                self._insert_run("".join(run_text), run_tag)
+                run_text, run_tag = [], tag
+            run_text.append(text)
+        self._insert_run("".join(run_text), run_tag)
         self.chat_display.configure(state=tk.DISABLED)
         self.chat_display.see(tk.END)
+    
+    def _insert_run(self, text, tag):
+        if tag is None:
+            self.chat_display.insert(tk.END, text)
+        else:
+            self.chat_display.insert(tk.END, text, tag)
+    
+    def clear_chat(self):
+        """Очистка окна чата вместе с еще не выведенным текстом"""
+        self._render_buf = []
+        self._stream_active = False
+        self.chat_display.config(state=tk.NORMAL)
+        self.chat_display.delete("1.0", tk.END)
+        self.chat_display.config(state=tk.DISABLED)
 
     # ------------------------------------------------------------
     # Горячие клавиши и обработчики ввода
@@ -438,8 +830,9 @@ class ChatBotGUI:
     # Удалены устаревшие обработчики для chat_display
     
     def send_message(self):
-        """Отправка сообщения агенту"""
-        if not self.giga_client:
+        """Отправка сообщения агенту (сообщения, отправленные подряд, объединяются)"""
+        # Кнопка неактивна, пока клиент подключается или ждет ответа
+        if not self.giga_client or str(self.send_button.cget("state")) == tk.DISABLED:
             return
         
         message = self.message_entry.get("1.0", tk.END).strip()
@@ -453,65 +846,146 @@ class ChatBotGUI:
         # Добавляем сообщение пользователя
         self.add_message("user", message)
         
+        # Откладываем запрос: сообщения в пределах окна уйдут одним запросом
+        self._pending.append(message)
+        if self._debounce_id is not None:
+            self.root.after_cancel(self._debounce_id)
+        self._debounce_id = self.root.after(SEND_DEBOUNCE_MS, self._flush_pending)
+    
+    def _flush_pending(self):
+        """Отправка накопленных сообщений одним запросом"""
+        from gigachat.models import Messages, MessagesRole
+        
+        self._debounce_id = None
+        if not self._pending:
+            return
+        message = "\n\n".join(self._pending)
+        self._pending = []
+        
         # Добавляем в историю
-        self.conversation_history.append(Messages(role=MessagesRole.USER, content=message))
+        self.conversation_history.append(construct_model(Messages, role=MessagesRole.USER, content=message))
         
         # Блокируем элементы
         self.send_button.config(state=tk.DISABLED, text="Отправка...")
         self.message_entry.config(state=tk.DISABLED)
         
-        # Запускаем запрос в отдельном потоке
-        Thread(target=self.get_bot_response, args=(message,), daemon=True).start()
+        # Передаем запрос фоновому потоку
+        self.submit_job(self.get_bot_response, message)
+    
+    def _cancel_pending(self):
+        """Отмена еще не отправленных сообщений"""
+        if self._debounce_id is not None:
+            self.root.after_cancel(self._debounce_id)
+            self._debounce_id = None
+        self._pending = []
     
     def get_bot_response(self, user_message):
-        """Получение ответа от агента с учетом истории диалога"""
+        """Получение ответа от агента с учетом истории диалога (потоковый вывод)"""
+        from gigachat.models import Messages, MessagesRole
+        
+        def on_chunk(delta):
+            self.post_ui(self._append_stream_chunk, delta)
+        
         try:
-            # Создаем чат с полной историей диалога
-            chat = Chat(
-                messages=self.conversation_history,
-                model=self.current_model,
-                temperature=self.temperature,
-                flags=self.request_flags
-            )
+            # Сначала пробуем найти ответ на похожий вопрос в семантическом кеше
+            query_vector = self._semantic_query_vector(user_message)
+            bot_message = self._semantic_lookup(query_vector) if query_vector is not None else None
             
-            response = self.giga_client.chat(chat)
-            bot_message = response.choices[0].message.content
+            if bot_message is not None:
+                on_chunk(bot_message)
+            else:
+                # Запрашиваем ответ с историей диалога (старая часть сжимается в резюме)
+                self._maybe_compact_history()
+                bot_message = self.request_completion("chat", self.conversation_history, on_chunk=on_chunk)
+                if query_vector is not None:
+                    with self._response_cache_lock:
+                        self._semantic_cache.append((query_vector, bot_message))
             
             # Добавляем ответ в историю
-            self.conversation_history.append(Messages(role=MessagesRole.ASSISTANT, content=bot_message))
+            self.conversation_history.append(construct_model(Messages, role=MessagesRole.ASSISTANT, content=bot_message))
             
             # Определяем, является ли это ТЗ (проверяем ключевые слова)
-            is_tz = any(keyword in bot_message.lower() for keyword in [
-                "техническое задание", "тз", "проект:", "цели:", "источники данных:"
-            ]) and "спасибо за ответы" in bot_message.lower()
+            # Сначала ищем более редкую фразу-подтверждение
+            is_tz = bool(TZ_CONFIRM_RE.search(bot_message) and TZ_KEYWORDS_RE.search(bot_message))
             
-            # Обновляем UI в главном потоке
-            if is_tz:
-                self.root.after(0, lambda: self.display_tz(bot_message))
-            else:
-                self.root.after(0, lambda: self.display_response(bot_message))
+            # Завершаем потоковый вывод в главном потоке (текст уже выведен)
+            self.post_ui(self._finish, "tz" if is_tz else "bot", None)
             
         except Exception as e:
             error_msg = f"Ошибка: {str(e)}"
-            self.root.after(0, lambda: self.display_error(error_msg))
+            self.post_ui(self._finish, "error", error_msg)
     
-    def display_response(self, message):
-        """Отображение ответа"""
-        self.add_message("bot", message)
-        self.send_button.config(state=tk.NORMAL, text="Отправить")
-        self.message_entry.config(state=tk.NORMAL)
-        self.message_entry.focus()
+    def _maybe_compact_history(self):
+        """Замена старой части истории одним системным сообщением с резюме"""
+        from gigachat.models import Chat, Messages, MessagesRole
+        
+        if len(self.conversation_history) <= HISTORY_COMPACT_THRESHOLD:
+            return
+        
+        # Предыдущее резюме (если было) попадает в сжимаемый фрагмент
+        dropped = self.conversation_history[1:-HISTORY_KEEP_MESSAGES]
+        transcript = "\n\n".join(
+            f"{'Пользователь' if message.role == MessagesRole.USER else 'Агент'}: {message.content}"
+            for message in dropped
+        )
+        chat = construct_model(
+            Chat,
+            messages=[
+                construct_model(Messages, role=MessagesRole.SYSTEM, content=HISTORY_SUMMARY_PROMPT),
+                construct_model(Messages, role=MessagesRole.USER, content=transcript)
+            ],
+            model=self.current_model,
+            temperature=0.1,
+            flags=self.request_flags
+        )
+        try:
+            self._bucket.acquire()
+            response = self.giga_client.chat(chat)
+        except Exception:
+            # Без резюме отбрасываем самые старые сообщения сверх жесткого лимита
+            if len(self.conversation_history) > HISTORY_MAX_MESSAGES:
+                del self.conversation_history[1:-(HISTORY_MAX_MESSAGES - 1)]
+            return
+        summary = response.choices[0].message.content.strip()
+        
+        self.conversation_history[1:-HISTORY_KEEP_MESSAGES] = [
+            construct_model(Messages, role=MessagesRole.SYSTEM, content=f"Краткое резюме предыдущей части диалога: {summary}")
+        ]
     
-    def display_tz(self, message):
-        """Отображение технического задания"""
-        self.add_message("tz", message)
-        self.send_button.config(state=tk.NORMAL, text="Отправить")
-        self.message_entry.config(state=tk.NORMAL)
-        self.message_entry.focus()
+    def _append_stream_chunk(self, delta):
+        """Дописывание очередной части ответа в окно чата"""
+        if not self._stream_active:
+            self._stream_active = True
+            time_str = datetime.now().strftime("%H:%M")
+            self.queue_render(f"[{time_str}] ")
+            # Временный тег stream_label отмечает подпись, чтобы заменить ее для ТЗ
+            self.queue_render(BOT_LABEL, ("bot_tag", "stream_label"))
+        self.queue_render(delta)
+    
+    def _close_stream(self, is_tz):
+        """Завершение потокового сообщения (при ТЗ меняем подпись отправителя)"""
+        if not self._stream_active:
+            return
+        self._stream_active = False
+        self._flush_render()
+        
+        self.chat_display.configure(state=tk.NORMAL)
+        label_range = self.chat_display.tag_ranges("stream_label")
+        if label_range:
+            if is_tz:
+                self.chat_display.delete(label_range[0], label_range[1])
+                self.chat_display.insert(label_range[0], "📋 ТЗ: ", "tz_tag")
+            else:
+                self.chat_display.tag_remove("stream_label", label_range[0], label_range[1])
+        self.chat_display.insert(tk.END, "\n\n")
+        self.chat_display.configure(state=tk.DISABLED)
+        self.chat_display.see(tk.END)
     
-    def display_error(self, error_msg):
-        """Отображение ошибки"""
-        self.add_message("error", error_msg)
+    def _finish(self, tag, message):
+        """Завершение ответа: вывод сообщения (None - уже выведено потоком) и разблокировка ввода"""
+        self._close_stream(tag == "tz")
+        if message is not None:
+            self.add_message(tag, message)
         self.send_button.config(state=tk.NORMAL, text="Отправить")
         self.message_entry.config(state=tk.NORMAL)
         self.message_entry.focus()
@@ -520,7 +994,7 @@ class ChatBotGUI:
         """Открытие окна настроек"""
         settings_window = tk.Toplevel(self.root)
         settings_window.title("Настройки агента")
-        settings_window.geometry("840x750")
+        settings_window.geometry("840x880")
         settings_window.configure(bg="#f8f9fa")
         settings_window.transient(self.root)
         settings_window.grab_set()
@@ -724,12 +1198,61 @@ class ChatBotGUI:
         )
         temperature_spinbox.pack(pady=5)
         
+        # Фрейм для настройки кеширования ответов
+        cache_frame = tk.LabelFrame(
+            settings_window,
+            text="Кеширование",
+            font=("Arial", 11, "bold"),
+            bg="#f8f9fa",
+            fg="#333333",
+            padx=10,
+            pady=10
+        )
+        cache_frame.pack(fill=tk.X, padx=10, pady=5)
+        
+        response_cache_var = tk.BooleanVar(value=self.response_cache_enabled)
+        response_cache_check = tk.Checkbutton(
+            cache_frame,
+            text="Повторно использовать ответы на одинаковые запросы (без обращения к API)",
+            variable=response_cache_var,
+            font=("Arial", 10),
+            bg="#f8f9fa",
+            anchor="w"
+        )
+        response_cache_check.pack(fill=tk.X, padx=5, pady=2)
+        
+        semantic_cache_var = tk.BooleanVar(value=self.semantic_cache_enabled and np is not None)
+        semantic_cache_check = tk.Checkbutton(
+            cache_frame,
+            text="Семантический кеш для похожих вопросов (только режим «Без настроек», нужен numpy)",
+            variable=semantic_cache_var,
+            font=("Arial", 10),
+            bg="#f8f9fa",
+            anchor="w",
+            state=tk.NORMAL if np is not None else tk.DISABLED
+        )
+        semantic_cache_check.pack(fill=tk.X, padx=5, pady=2)
+        
+        # Режим разработчика: отключает серверное кеширование (флаг no_cache)
+        dev_mode_var = tk.BooleanVar(value=self.dev_mode)
+        dev_mode_check = tk.Checkbutton(
+            cache_frame,
+            text="Режим разработчика: отключить серверный кеш GigaChat (no_cache)",
+            variable=dev_mode_var,
+            font=("Arial", 10),
+            bg="#f8f9fa",
+            anchor="w"
+        )
+        dev_mode_check.pack(fill=tk.X, padx=5, pady=2)
+        
         # Фрейм для кнопок
         button_frame = tk.Frame(settings_window, bg="#f8f9fa")
         button_frame.pack(fill=tk.X, padx=10, pady=10)
         
         # Кнопка применения
         def apply_settings():
+            from gigachat.models import Messages, MessagesRole
+            
             new_prompt = editor.get("1.0", tk.END).strip()
             if not new_prompt:
                 messagebox.showerror("Ошибка", "Промпт не может быть пустым!")
@@ -764,23 +1287,34 @@ class ChatBotGUI:
             self.temperature = round(temp_value, 2)
             temperature_var.set(f"{self.temperature:.2f}")
             
+            # Обновляем настройки кеширования
+            self.response_cache_enabled = response_cache_var.get()
+            self.semantic_cache_enabled = semantic_cache_var.get()
+            with self._response_cache_lock:
+                if not self.response_cache_enabled:
+                    self._response_cache.clear()
+                # Ответы из семантического кеша привязаны к прежним промпту и модели
+                self._semantic_cache.clear()
+            self.dev_mode = dev_mode_var.get()
+            self.request_flags = ["no_cache"] if self.dev_mode else []
+            
+            # Новый системный промпт меняет префикс запросов, поэтому серверный
+            # кеш префикса после перезапуска диалога заполняется заново
             # Перезапускаем диалог с новым промптом
+            self._cancel_pending()
             self.conversation_history = [
-                Messages(role=MessagesRole.SYSTEM, content=self.current_prompt)
+                construct_model(Messages, role=MessagesRole.SYSTEM, content=self.current_prompt)
             ]
             
             # Очищаем чат
-            self.chat_display.config(state=tk.NORMAL)
-            self.chat_display.delete("1.0", tk.END)
-            self.chat_display.config(state=tk.DISABLED)
+            self.clear_chat()
             
             # Обновляем информационную панель
-            model_display = "Pro" if self.current_model == "GigaChat-Pro" else "Lite"
-            self.info_label.config(text=f"Режим: {self.current_prompt_name} | Модель: {model_display} | Температура: {self.temperature:.2f}")
+            self.update_info_label()
             
             # Получаем новое приветствие
             if self.giga_client:
-                Thread(target=self.get_initial_greeting, daemon=True).start()
+                self.submit_job(self.get_initial_greeting)
             
             messagebox.showinfo("Успех", "Настройки применены! Диалог перезапущен с новым промптом.")
             settings_window.destroy()
@@ -837,6 +1371,7 @@ class ChatBotGUI:
     
     def on_closing(self):
         """Обработка закрытия приложения"""
+        self._jobs.put(None)
         if self.giga_client:
             try:
                 self.giga_client.__exit__(None, None, None)
@@ -1,23 +1,43 @@
 """
 Веб-чат с GigaChat и Hugging Face на Flask.
+
+Запуск для разработки: python chatbot_gui.py
+Запуск в продакшене (gevent: пока один запрос ждет ответа модели, воркер обслуживает другие):
+    gunicorn "chatbot_gui:create_app()"
+Настройки лежат в gunicorn.conf.py (воркер gevent, 1000 соединений, порт из PORT).
+Воркер должен быть один: история диалогов хранится в памяти процесса (_HISTORY),
+а конкурентность обеспечивают гринлеты gevent. Воркер gevent сам применяет
+monkey-patching до загрузки приложения.
 """
 
 from __future__ import annotations
 
+import atexit
 import json
 import os
 import re
+import secrets
+import sys
 from collections import OrderedDict
-from typing import Dict, List, Tuple
+from functools import lru_cache
+from typing import Dict, Iterator, List, Tuple
 
 import requests
 import time
+from threading import Lock
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
-from flask import Flask, flash, redirect, render_template, request, session, url_for
+from flask import Flask, Response, flash, redirect, render_template, request, session, url_for
+from flask.json.provider import DefaultJSONProvider
 from gigachat import GigaChat
 from gigachat.models import Chat, Messages, MessagesRole
 from huggingface_hub import InferenceClient
 
+try:
+    import orjson
+except ImportError:  # Без orjson используется стандартный json
+    orjson = None
+
 # Настраиваем переменные окружения
 load_dotenv()
 
@@ -82,30 +102,94 @@ AVAILABLE_PROVIDERS = OrderedDict(
 )
 SESSION_KEY = "chat_state"
 
+# Допустимые пары (провайдер, модель) и их параметры одним плоским словарем
+_META: Dict[Tuple[str, str], Dict[str, str]] = {
+    (provider, model): meta
+    for provider, provider_info in AVAILABLE_PROVIDERS.items()
+    for model, meta in provider_info["models"].items()
+}
+_VALID = frozenset(_META)
+
+# Сколько диалогов хранится на сервере (самые давние вытесняются)
+HISTORY_STORE_SIZE = 10_000
+
+# Роли и ключи сообщений (одни и те же объекты строк во всех запросах)
+_ROLE = sys.intern("role")
+_CONTENT = sys.intern("content")
+_SYSTEM = sys.intern("system")
+_USER = sys.intern("user")
+_ASSISTANT = sys.intern("assistant")
+_ROLE_MAP = {"user": _USER, "assistant": _ASSISTANT}
+_GIGACHAT_ROLE_MAP = {"user": MessagesRole.USER, "assistant": MessagesRole.ASSISTANT}
+
+# Символы, которые заменяются дефисом в идентификаторе пресета
+_SLUG_RE = re.compile(r"[^a-zA-Z0-9]+")
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON-провайдер Flask на orjson (cookie сессии и jsonify)"""
+
+    def dumps(self, obj, **kwargs) -> str:
+        option = orjson.OPT_NON_STR_KEYS
+        if kwargs.get("sort_keys", self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.getenv("FLASK_SECRET_KEY", "change-me")
+if orjson is not None:
+    app.json = OrjsonProvider(app)
 
 
 # ---------------------------------------------------------------------------
 # Утилиты для загрузки и подготовки промптов
 # ---------------------------------------------------------------------------
 
+# Разобранные файлы пресетов: путь -> (mtime_ns, размер, данные)
+_PRESET_CACHE: Dict[str, Tuple[int, int, OrderedDict[str, str]]] = {}
+
+# Собранные пресеты: ((mtime_ns, размер) файла промптов, то же для названий) -> пресеты
+_merged_cache: Tuple[tuple, OrderedDict[str, Dict[str, str]]] | None = None
+
+
+def _file_signature(file_path: str) -> Tuple[int, int] | None:
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
 def _load_json_mapping(file_path: str) -> OrderedDict[str, str]:
-    if not os.path.exists(file_path):
+    # Файл перечитывается, только если изменились время модификации или размер
+    try:
+        st = os.stat(file_path)
+    except OSError:
         return OrderedDict()
+    cached = _PRESET_CACHE.get(file_path)
+    if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
     try:
-        with open(file_path, "r", encoding="utf-8") as file:
-            data = json.load(file)
-            if isinstance(data, dict):
-                return OrderedDict(data)
+        with open(file_path, "rb") as file:
+            raw = file.read()
+        data = orjson.loads(raw) if orjson is not None else json.loads(raw)
+        if isinstance(data, dict):
+            mapping = OrderedDict(data)
+            _PRESET_CACHE[file_path] = (st.st_mtime_ns, st.st_size, mapping)
+            return mapping
     except Exception:
         pass
     return OrderedDict()
 
 
 def load_raw_preset_files() -> Tuple[OrderedDict[str, str], OrderedDict[str, str]]:
-    prompts = _load_json_mapping(PROMPTS_FILE_PATH)
-    names = _load_json_mapping(PROMPT_NAMES_FILE_PATH)
+    # Копии, чтобы изменения перед записью не портили кеш
+    prompts = OrderedDict(_load_json_mapping(PROMPTS_FILE_PATH))
+    names = OrderedDict(_load_json_mapping(PROMPT_NAMES_FILE_PATH))
 
     if not prompts:
         prompts = OrderedDict(DEFAULT_PRESET_PROMPTS)
@@ -116,6 +200,13 @@ def load_raw_preset_files() -> Tuple[OrderedDict[str, str], OrderedDict[str, str
 
 
 def load_presets() -> OrderedDict[str, Dict[str, str]]:
+    global _merged_cache
+
+    cache_key = (_file_signature(PROMPTS_FILE_PATH), _file_signature(PROMPT_NAMES_FILE_PATH))
+    merged = _merged_cache
+    if merged is not None and merged[0] == cache_key:
+        return merged[1]
+
     prompts, names = load_raw_preset_files()
     presets = OrderedDict()
 
@@ -133,19 +224,34 @@ def load_presets() -> OrderedDict[str, Dict[str, str]]:
             "prompt": DEFAULT_PRESET_PROMPTS[DEFAULT_PRESET_KEY],
         }
 
+    _merged_cache = (cache_key, presets)
     return presets
 
 
+def invalidate_presets() -> None:
+    global _merged_cache
+
+    _merged_cache = None
+    _PRESET_CACHE.clear()
+
+
 def write_presets(prompts: OrderedDict[str, str], names: OrderedDict[str, str]) -> None:
     os.makedirs(CONFIG_DIR, exist_ok=True)
-    with open(PROMPTS_FILE_PATH, "w", encoding="utf-8") as prompts_file:
-        json.dump(prompts, prompts_file, ensure_ascii=False, indent=2)
-    with open(PROMPT_NAMES_FILE_PATH, "w", encoding="utf-8") as names_file:
-        json.dump(names, names_file, ensure_ascii=False, indent=2)
+    for file_path, mapping in ((PROMPTS_FILE_PATH, prompts), (PROMPT_NAMES_FILE_PATH, names)):
+        with open(file_path, "wb") as file:
+            file.write(_dump_json_bytes(mapping))
+    invalidate_presets()
+
+
+def _dump_json_bytes(data: object) -> bytes:
+    # orjson сразу выдает UTF-8 без экранирования кириллицы
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
 
 
 def slugify(title: str) -> str:
-    slug = re.sub(r"[^a-zA-Z0-9]+", "-", title).strip("-").lower()
+    slug = _SLUG_RE.sub("-", title).strip("-").lower()
     return slug or "preset"
 
 
@@ -158,36 +264,116 @@ def default_chat_state(presets: OrderedDict[str, Dict[str, str]]) -> Dict[str, o
     preset_key = DEFAULT_PRESET_KEY if DEFAULT_PRESET_KEY in presets else next(iter(presets))
     provider_key = DEFAULT_PROVIDER if DEFAULT_PROVIDER in AVAILABLE_PROVIDERS else next(iter(AVAILABLE_PROVIDERS))
     return {
+        "sid": secrets.token_urlsafe(16),
         "preset_key": preset_key,
         "temperature": DEFAULT_TEMPERATURE,
         "provider": provider_key,
         "model": default_model_for(provider_key),
-        "history": [],
     }
 
 
+# ---------------------------------------------------------------------------
+# История диалогов (хранится на сервере, в cookie сессии только sid)
+# ---------------------------------------------------------------------------
+
+_HISTORY: OrderedDict[str, List[Dict[str, object]]] = OrderedDict()
+_HISTORY_LOCK = Lock()
+
+
+def get_history(sid: str) -> List[Dict[str, object]]:
+    # Только чтение: запросы без диалога (краулеры, health-check) не занимают место в хранилище
+    with _HISTORY_LOCK:
+        history = _HISTORY.get(sid)
+        if history is None:
+            return []
+        _HISTORY.move_to_end(sid)
+        return list(history)
+
+
+def append_turn(sid: str, *messages: Dict[str, object]) -> None:
+    # Запись в историю создается только вместе с первым ходом диалога
+    with _HISTORY_LOCK:
+        history = _HISTORY.get(sid)
+        if history is None:
+            history = _HISTORY[sid] = []
+            if len(_HISTORY) > HISTORY_STORE_SIZE:
+                _HISTORY.popitem(last=False)
+        else:
+            _HISTORY.move_to_end(sid)
+        history.extend(messages)
+
+
+def reset_history(sid: str) -> None:
+    with _HISTORY_LOCK:
+        _HISTORY.pop(sid, None)
+
+
 def parse_temperature(raw_value: str | None, fallback: float) -> float:
-    if raw_value is None:
-        return fallback
+    # Считаем в сотых долях: округление до 0.01 и ограничение 0..2 в целых числах
     try:
-        temp = float(raw_value)
-    except ValueError:
+        temp = int(float(raw_value) * 100 + 0.5)
+    except (TypeError, ValueError, OverflowError):
         return fallback
-    temp = max(0.0, min(2.0, round(temp, 2)))
-    return temp
+    if temp < 0:
+        temp = 0
+    elif temp > 200:
+        temp = 200
+    return temp / 100.0
+
+
+# ---------------------------------------------------------------------------
+# HTTP-клиенты (создаются один раз и переиспользуют соединения)
+# ---------------------------------------------------------------------------
+
+@lru_cache(maxsize=1)
+def _hf_session() -> requests.Session:
+    http_session = requests.Session()
+    http_session.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=64))
+    return http_session
+
+
+@lru_cache(maxsize=1)
+def _hf_client(token: str) -> InferenceClient:
+    return InferenceClient(token=token)
+
+
+@lru_cache(maxsize=1)
+def _giga(credentials: str) -> GigaChat:
+    # Токен доступа и TLS-соединение живут вместе с клиентом, SDK сам обновляет токен
+    client = GigaChat(credentials=credentials, verify_ssl_certs=False)
+    client.__enter__()
+    atexit.register(client.__exit__, None, None, None)
+    return client
 
 
 # ---------------------------------------------------------------------------
 # GigaChat interaction
 # ---------------------------------------------------------------------------
 
-def ask_gigachat(
+def _extract_total_tokens(usage) -> int | None:
+    if usage is None:
+        return None
+    g = getattr
+    total_tokens = g(usage, "total_tokens", None)
+    if total_tokens is None:
+        prompt_tokens = g(usage, "prompt_tokens", None)
+        completion_tokens = g(usage, "completion_tokens", None)
+        if prompt_tokens is None or completion_tokens is None:
+            return None
+        total_tokens = prompt_tokens + completion_tokens
+    try:
+        return int(total_tokens)
+    except (TypeError, ValueError):
+        return None
+
+
+def _gigachat_request(
     system_prompt: str,
     history: List[Dict[str, str]],
     user_message: str,
     temperature: float,
     model: str | None = None,
-) -> Tuple[str, int | None, float]:
+) -> Tuple[GigaChat, Chat]:
     credentials = os.getenv("GIGACHAT_CREDENTIALS")
     if not credentials:
         raise RuntimeError(
@@ -200,44 +386,57 @@ def ask_gigachat(
 
     messages: List[Messages] = [
         Messages(role=MessagesRole.SYSTEM, content=system_prompt),
+        *[Messages(role=_GIGACHAT_ROLE_MAP[entry[_ROLE]], content=entry[_CONTENT]) for entry in history],
+        Messages(role=MessagesRole.USER, content=user_message),
     ]
 
-    for entry in history:
-        role = MessagesRole.USER if entry["role"] == "user" else MessagesRole.ASSISTANT
-        messages.append(Messages(role=role, content=entry["content"]))
-
-    messages.append(Messages(role=MessagesRole.USER, content=user_message))
-
     chat = Chat(
         messages=messages,
         model=model,
         temperature=temperature,
         flags=["no_cache"],
     )
+    return _giga(credentials), chat
 
-    with GigaChat(credentials=credentials, verify_ssl_certs=False) as client:
-        start = time.perf_counter()
-        response = client.chat(chat)
-        elapsed = time.perf_counter() - start
 
-    usage = getattr(response, "usage", None)
-    total_tokens = None
-    if usage is not None:
-        total_tokens = getattr(usage, "total_tokens", None)
-        if total_tokens is None:
-            prompt_tokens = getattr(usage, "prompt_tokens", None)
-            completion_tokens = getattr(usage, "completion_tokens", None)
-            if prompt_tokens is not None and completion_tokens is not None:
-                total_tokens = prompt_tokens + completion_tokens
-        if total_tokens is not None:
-            try:
-                total_tokens = int(total_tokens)
-            except (TypeError, ValueError):
-                total_tokens = None
+def ask_gigachat(
+    system_prompt: str,
+    history: List[Dict[str, str]],
+    user_message: str,
+    temperature: float,
+    model: str | None = None,
+) -> Tuple[str, int | None, float]:
+    client, chat = _gigachat_request(system_prompt, history, user_message, temperature, model)
+    start = time.perf_counter()
+    response = client.chat(chat)
+    elapsed = time.perf_counter() - start
 
+    total_tokens = _extract_total_tokens(getattr(response, "usage", None))
     return response.choices[0].message.content, total_tokens, elapsed
 
 
+def stream_gigachat(
+    system_prompt: str,
+    history: List[Dict[str, str]],
+    user_message: str,
+    temperature: float,
+    model: str | None = None,
+) -> Iterator[str]:
+    client, chat = _gigachat_request(system_prompt, history, user_message, temperature, model)
+    for chunk in client.stream(chat):
+        delta = chunk.choices[0].delta.content
+        if delta:
+            yield delta
+
+
+def _hf_chat_messages(system_prompt: str, history: List[Dict[str, str]], user_message: str) -> List[Dict[str, str]]:
+    return [
+        {_ROLE: _SYSTEM, _CONTENT: system_prompt.strip() or "You are a helpful assistant."},
+        *[{_ROLE: _ROLE_MAP[entry[_ROLE]], _CONTENT: entry[_CONTENT]} for entry in history],
+        {_ROLE: _USER, _CONTENT: user_message},
+    ]
+
+
 def ask_huggingface(
     system_prompt: str,
     history: List[Dict[str, str]],
@@ -254,7 +453,7 @@ def ask_huggingface(
             "Добавьте ключ авторизации в .env или переменные окружения."
         )
 
-    client = InferenceClient(token=token)
+    client = _hf_client(token)
 
     headers = {
         "Authorization": f"Bearer {token}",
@@ -262,18 +461,7 @@ def ask_huggingface(
     }
 
     if mode == "chat-completion":
-        messages = [
-            {
-                "role": "system",
-                "content": system_prompt.strip() or "You are a helpful assistant.",
-            }
-        ]
-        for entry in history:
-            if entry["role"] == "user":
-                messages.append({"role": "user", "content": entry["content"]})
-            elif entry["role"] == "assistant":
-                messages.append({"role": "assistant", "content": entry["content"]})
-        messages.append({"role": "user", "content": user_message})
+        messages = _hf_chat_messages(system_prompt, history, user_message)
 
         try:
             start = time.perf_counter()
@@ -304,20 +492,7 @@ def ask_huggingface(
         content = getattr(message, "content", "").strip()
         if not content:
             raise RuntimeError(f"Пустой ответ от Hugging Face: {completion}")
-        usage = getattr(completion, "usage", None)
-        total_tokens = None
-        if usage is not None:
-            total_tokens = getattr(usage, "total_tokens", None)
-            if total_tokens is None:
-                prompt_tokens = getattr(usage, "prompt_tokens", None)
-                completion_tokens = getattr(usage, "completion_tokens", None)
-                if prompt_tokens is not None and completion_tokens is not None:
-                    total_tokens = prompt_tokens + completion_tokens
-            if total_tokens is not None:
-                try:
-                    total_tokens = int(total_tokens)
-                except (TypeError, ValueError):
-                    total_tokens = None
+        total_tokens = _extract_total_tokens(getattr(completion, "usage", None))
         return content, total_tokens, elapsed
 
     # Fallback to text-generation endpoint
@@ -328,6 +503,7 @@ def ask_huggingface(
     lines.append(f"User: {user_message}")
     lines.append("Assistant:")
     prompt_text = "\n".join(lines)
+    prompt_len = len(prompt_text)
 
     payload = {
         "model": model,
@@ -336,12 +512,12 @@ def ask_huggingface(
         "parameters": {
             "temperature": temperature,
             "max_new_tokens": 256,
-            "return_full_text": True,
+            "return_full_text": False,
         },
     }
 
     start = time.perf_counter()
-    response = requests.post(
+    response = _hf_session().post(
         "https://router.huggingface.co/hf-inference/text-generation",
         headers=headers,
         params={"model": model},
@@ -376,49 +552,104 @@ def ask_huggingface(
     if not generated_text:
         raise RuntimeError(f"Пустой ответ от Hugging Face: {data}")
 
-    if generated_text.startswith(prompt_text):
-        generated_text = generated_text[len(prompt_text):]
+    # Модель отвечает без промпта, но некоторые эндпоинты все равно возвращают его целиком
+    if len(generated_text) >= prompt_len and generated_text[:prompt_len] == prompt_text:
+        generated_text = generated_text[prompt_len:]
 
     return generated_text.strip() or "Не удалось получить содержательный ответ от модели Hugging Face.", None, elapsed
 
 
+def stream_huggingface(
+    system_prompt: str,
+    history: List[Dict[str, str]],
+    user_message: str,
+    temperature: float,
+    model: str,
+    task: str = "text-generation",
+    mode: str = "chat-completion",
+) -> Iterator[str]:
+    if mode != "chat-completion":
+        # Эндпоинт text-generation не отдает ответ по частям
+        yield ask_huggingface(system_prompt, history, user_message, temperature, model, task, mode)[0]
+        return
+
+    token = os.getenv("HUGGINGFACE_API_TOKEN")
+    if not token:
+        raise RuntimeError(
+            "Не найден HUGGINGFACE_API_TOKEN. "
+            "Добавьте ключ авторизации в .env или переменные окружения."
+        )
+
+    for chunk in _hf_client(token).chat.completions.create(
+        model=model,
+        messages=_hf_chat_messages(system_prompt, history, user_message),
+        max_tokens=512,
+        temperature=temperature,
+        stream=True,
+    ):
+        choices = getattr(chunk, "choices", None)
+        if choices and choices[0].delta.content:
+            yield choices[0].delta.content
+
+
 # ---------------------------------------------------------------------------
 # Flask views
 # ---------------------------------------------------------------------------
 
-@app.route("/", methods=["GET", "POST"])
-def index():
-    presets = load_presets()
+def load_chat_state(presets: OrderedDict[str, Dict[str, str]]) -> Dict[str, object]:
     state = session.get(SESSION_KEY)
 
     if (
         not state
+        or "sid" not in state
         or state.get("preset_key") not in presets
-        or state.get("provider") not in AVAILABLE_PROVIDERS
-        or state.get("model") not in AVAILABLE_PROVIDERS.get(state.get("provider", ""), {}).get("models", {})
+        or (state.get("provider"), state.get("model")) not in _VALID
     ):
-        state = default_chat_state(presets)
-    else:
-        state.pop("custom_prompt", None)
+        return default_chat_state(presets)
 
-    if request.method == "POST":
-        action = request.form.get("action", "send")
-        preset_key = request.form.get("preset") or state["preset_key"]
-        if preset_key not in presets:
-            preset_key = next(iter(presets))
+    # Устаревшие ключи удаляются прямо в сессии, поэтому ее нужно пересохранить
+    stale_keys = [key for key in ("custom_prompt", "history") if key in state]
+    if stale_keys:
+        for key in stale_keys:
+            del state[key]
+        session.modified = True
+    return state
 
-        temperature = parse_temperature(
-            request.form.get("temperature"),
-            state.get("temperature", DEFAULT_TEMPERATURE),
-        )
-        provider = request.form.get("provider") or state.get("provider", DEFAULT_PROVIDER)
-        if provider not in AVAILABLE_PROVIDERS:
-            provider = DEFAULT_PROVIDER
 
-        provider_models = AVAILABLE_PROVIDERS[provider]["models"]
-        model = request.form.get("model") or state.get("model")
-        if model not in provider_models:
-            model = default_model_for(provider)
+def resolve_settings(
+    values, state: Dict[str, object], presets: OrderedDict[str, Dict[str, str]]
+) -> Tuple[str, float, str, str]:
+    preset_key = values.get("preset") or state["preset_key"]
+    if preset_key not in presets:
+        preset_key = next(iter(presets))
+
+    temperature = parse_temperature(
+        values.get("temperature"),
+        state.get("temperature", DEFAULT_TEMPERATURE),
+    )
+    provider = values.get("provider") or state.get("provider", DEFAULT_PROVIDER)
+    if provider not in AVAILABLE_PROVIDERS:
+        provider = DEFAULT_PROVIDER
+
+    model = values.get("model") or state.get("model")
+    if (provider, model) not in _VALID:
+        model = default_model_for(provider)
+
+    return preset_key, temperature, provider, model
+
+
+def _sse_event(event: str, data: object) -> str:
+    return f"event: {event}\ndata: {app.json.dumps(data)}\n\n"
+
+
+@app.route("/", methods=["GET", "POST"])
+def index():
+    presets = load_presets()
+    state = load_chat_state(presets)
+
+    if request.method == "POST":
+        action = request.form.get("action", "send")
+        preset_key, temperature, provider, model = resolve_settings(request.form, state, presets)
 
         if action == "save_preset":
             preset_title = request.form.get("preset_title", "").strip()
@@ -442,12 +673,13 @@ def index():
                 write_presets(raw_prompts, raw_names)
 
                 presets = load_presets()
+                reset_history(state["sid"])
                 state = {
+                    "sid": state["sid"],
                     "preset_key": slug,
                     "temperature": temperature,
                     "provider": provider,
                     "model": model,
-                    "history": [],
                 }
                 session[SESSION_KEY] = state
                 session.modified = True
@@ -468,12 +700,13 @@ def index():
             return redirect(url_for("index"))
 
         if action == "reset":
+            reset_history(state["sid"])
             state = {
+                "sid": state["sid"],
                 "preset_key": preset_key,
                 "temperature": temperature,
                 "provider": provider,
                 "model": model,
-                "history": [],
             }
             session[SESSION_KEY] = state
             session.modified = True
@@ -503,12 +736,13 @@ def index():
         )
 
         if settings_changed:
+            reset_history(state["sid"])
             state = {
+                "sid": state["sid"],
                 "preset_key": preset_key,
                 "temperature": temperature,
                 "provider": provider,
                 "model": model,
-                "history": [],
             }
         else:
             state.update(
@@ -521,23 +755,24 @@ def index():
             )
 
         system_prompt = presets[preset_key]["prompt"]
+        history = get_history(state["sid"])
 
         try:
             if provider == "gigachat":
                 assistant_text, total_tokens, elapsed = ask_gigachat(
                     system_prompt=system_prompt,
-                    history=state["history"],
+                    history=history,
                     user_message=message,
                     temperature=temperature,
                     model=model,
                 )
             else:
-                model_meta = AVAILABLE_PROVIDERS[provider]["models"].get(model, {})
+                model_meta = _META[(provider, model)]
                 task = model_meta.get("task", "text-generation")
                 mode = model_meta.get("mode", "text-generation")
                 assistant_text, total_tokens, elapsed = ask_huggingface(
                     system_prompt=system_prompt,
-                    history=state["history"],
+                    history=history,
                     user_message=message,
                     temperature=temperature,
                     model=model,
@@ -550,36 +785,125 @@ def index():
             session.modified = True
             return redirect(url_for("index"))
 
-        state["history"].append({"role": "user", "content": message})
         meta = {
             "provider": provider,
             "model": model,
             "elapsed": elapsed,
             "tokens": total_tokens,
         }
-        state["history"].append({"role": "assistant", "content": assistant_text, "meta": meta})
+        append_turn(
+            state["sid"],
+            {"role": "user", "content": message},
+            {"role": "assistant", "content": assistant_text, "meta": meta},
+        )
 
         session[SESSION_KEY] = state
         session.modified = True
 
         return redirect(url_for("index"))
 
-    session[SESSION_KEY] = state
-    session.modified = True
+    # Cookie переподписывается, только если состояние создано заново
+    if session.get(SESSION_KEY) is not state:
+        session[SESSION_KEY] = state
     return render_template(
         "index.html",
         presets=presets,
         providers=AVAILABLE_PROVIDERS,
         state=state,
-        history=state["history"],
+        history=get_history(state["sid"]),
         models=AVAILABLE_PROVIDERS[state["provider"]]["models"],
     )
 
 
+@app.route("/stream", methods=["POST"])
+def stream():
+    # POST: ход меняет историю и сессию, а сообщение любой длины передается в теле запроса
+    presets = load_presets()
+    state = load_chat_state(presets)
+    preset_key, temperature, provider, model = resolve_settings(request.form, state, presets)
+    message = request.form.get("message", "").strip()
+
+    settings_changed = (
+        state["preset_key"] != preset_key
+        or state.get("provider", DEFAULT_PROVIDER) != provider
+        or abs(state.get("temperature", DEFAULT_TEMPERATURE) - temperature) > 1e-6
+        or state.get("model") != model
+    )
+    if settings_changed:
+        reset_history(state["sid"])
+    state = {
+        "sid": state["sid"],
+        "preset_key": preset_key,
+        "temperature": temperature,
+        "provider": provider,
+        "model": model,
+    }
+    session[SESSION_KEY] = state
+    session.modified = True
+
+    system_prompt = presets[preset_key]["prompt"]
+    history = get_history(state["sid"])
+
+    def generate() -> Iterator[str]:
+        if not message:
+            yield _sse_event("fail", "Введите сообщение перед отправкой.")
+            return
+
+        if provider == "gigachat":
+            deltas = stream_gigachat(system_prompt, history, message, temperature, model)
+        else:
+            model_meta = _META[(provider, model)]
+            deltas = stream_huggingface(
+                system_prompt,
+                history,
+                message,
+                temperature,
+                model,
+                task=model_meta.get("task", "text-generation"),
+                mode=model_meta.get("mode", "text-generation"),
+            )
+
+        parts = []
+        start = time.perf_counter()
+        try:
+            for delta in deltas:
+                parts.append(delta)
+                yield _sse_event("token", delta)
+        except Exception as exc:  # noqa: BLE001
+            yield _sse_event("fail", f"Не удалось получить ответ: {exc}")
+            return
+        elapsed = time.perf_counter() - start
+
+        meta = {
+            "provider": provider,
+            "model": model,
+            "elapsed": elapsed,
+            "tokens": None,
+        }
+        append_turn(
+            state["sid"],
+            {"role": "user", "content": message},
+            {"role": "assistant", "content": "".join(parts), "meta": meta},
+        )
+        yield _sse_event("done", meta)
+
+    return Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 def create_app() -> Flask:
     return app
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5050)), debug=os.getenv("FLASK_DEBUG") == "1")
+    # Сервер разработки (запросы и так обрабатываются в отдельных потоках);
+    # для продакшена - gunicorn с настройками из gunicorn.conf.py
+    app.run(
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", 5050)),
+        debug=os.getenv("FLASK_DEBUG") == "1",
+    )
 
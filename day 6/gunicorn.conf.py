@@ -0,0 +1,30 @@
+"""
+Настройки gunicorn для веб-чата (читаются автоматически при запуске из этого каталога):
+    gunicorn "chatbot_gui:create_app()"
+
+Вызовы GigaChat и Hugging Face занимают секунды, а процессор почти не нагружают,
+поэтому запросы обслуживают гринлеты gevent: пока один ждет ответа модели,
+воркер ведет остальные. Воркер gevent сам применяет monkey-patching
+до загрузки приложения, и requests внутри chatbot_gui становится кооперативным.
+"""
+
+import os
+
+# Адрес и порт, как у сервера разработки (python chatbot_gui.py)
+bind = f"0.0.0.0:{os.getenv('PORT', 5050)}"
+
+# Один воркер: история диалогов хранится в памяти процесса (_HISTORY)
+workers = 1
+
+# Кооперативный воркер: конкурентность ограничена числом соединений, а не потоков
+worker_class = "gevent"
+
+# Сколько запросов воркер ведет одновременно
+worker_connections = int(os.getenv("WORKER_CONNECTIONS", 1000))
+
+# Перезапуск воркера, если цикл gevent заблокирован дольше (секунды);
+# долгий ответ модели цикл не блокирует, поэтому запас только на случай зависания
+timeout = 120
+
+# Сколько ждать завершения начатых ответов (в том числе потоковых) при перезапуске
+graceful_timeout = 30
@@ -8,9 +8,11 @@ GigaChat AI - Чат-бот с графическим интерфейсом
 """
 
 import os
+import sys
+import queue
 import tkinter as tk
 from tkinter import scrolledtext, messagebox
-from threading import Thread
+from threading import Thread, Lock
 from datetime import datetime
 from dotenv import load_dotenv
 from gigachat import GigaChat
@@ -18,6 +20,9 @@ from gigachat import GigaChat
 # Загружаем переменные окружения
 load_dotenv()
 
+# Период (мс) опроса очереди обновлений интерфейса от фонового потока
+UI_POLL_MS = 30
+
 
 class ChatBotGUI:
     def __init__(self, root):
@@ -26,15 +31,21 @@ class ChatBotGUI:
         self.root.geometry("700x600")
         self.root.configure(bg="#0066cc")
         
-        # Инициализация GigaChat клиента
+        # Клиент GigaChat создается при первом запросе (в фоновом потоке)
         self.giga_client = None
+        self._giga_lock = Lock()
+        self.credentials = None
         self.init_gigachat()
         
+        # Обновления интерфейса из фонового потока (разбираются в главном потоке)
+        self._ui_queue = queue.Queue()
+        
         # Создание интерфейса
         self.create_widgets()
+        self.root.after(UI_POLL_MS, self._drain)
         
     def init_gigachat(self):
-        """Инициализация GigaChat клиента"""
+        """Проверка ключа GigaChat (подключение откладывается до первого сообщения)"""
         credentials = os.getenv("GIGACHAT_CREDENTIALS")
         
         if not credentials:
@@ -46,15 +57,19 @@ class ChatBotGUI:
             )
             return
         
-        try:
-            self.giga_client = GigaChat(
-                credentials=credentials, 
-                verify_ssl_certs=False
-            )
-            self.giga_client.__enter__()
-        except Exception as e:
-            messagebox.showerror("Ошибка подключения", f"Не удалось подключиться к GigaChat API:\n{e}")
-            self.giga_client = None
+        self.credentials = credentials
+    
+    def get_client(self):
+        """Клиент GigaChat: подключение (OAuth и TLS) при первом обращении"""
+        with self._giga_lock:
+            if self.giga_client is None:
+                client = GigaChat(
+                    credentials=self.credentials, 
+                    verify_ssl_certs=False
+                )
+                client.__enter__()
+                self.giga_client = client
+            return self.giga_client
     
     def create_widgets(self):
         """Создание элементов интерфейса"""
@@ -85,11 +100,16 @@ class ChatBotGUI:
         )
         self.chat_display.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
         
+        # Настройка тегов (действуют для всего виджета, задаются один раз)
+        self.chat_display.tag_config("user_tag", foreground="#0066cc", font=("Arial", 11, "bold"))
+        self.chat_display.tag_config("bot_tag", foreground="#28a745", font=("Arial", 11, "bold"))
+        self.chat_display.tag_config("error_tag", foreground="#dc3545", font=("Arial", 11, "bold"))
+        
         # Приветственное сообщение
-        if self.giga_client:
+        if self.credentials:
             self.add_message("bot", "Привет! Я GigaChat AI. Готов помочь вам с любыми вопросами!")
         else:
-            self.add_message("error", "Ошибка: не удалось подключиться к GigaChat API")
+            self.add_message("error", "Ошибка: не найден ключ авторизации GigaChat API")
         
         # Фрейм для ввода
         input_frame = tk.Frame(self.root, bg="#0066cc")
@@ -129,7 +149,7 @@ class ChatBotGUI:
             relief=tk.RAISED,
             borderwidth=2,
             cursor="hand2",
-            state=tk.DISABLED if not self.giga_client else tk.NORMAL
+            state=tk.DISABLED if not self.credentials else tk.NORMAL
         )
         self.send_button.pack(side=tk.RIGHT)
         
@@ -158,17 +178,12 @@ class ChatBotGUI:
         # Сообщение
         self.chat_display.insert(tk.END, f"{message}\n\n")
         
-        # Настройка тегов
-        self.chat_display.tag_config("user_tag", foreground="#0066cc", font=("Arial", 11, "bold"))
-        self.chat_display.tag_config("bot_tag", foreground="#28a745", font=("Arial", 11, "bold"))
-        self.chat_display.tag_config("error_tag", foreground="#dc3545", font=("Arial", 11, "bold"))
-        
         self.chat_display.config(state=tk.DISABLED)
         self.chat_display.see(tk.END)
     
     def send_message(self):
         """Отправка сообщения боту"""
-        if not self.giga_client:
+        if not self.credentials:
             return
         
         message = self.message_entry.get("1.0", tk.END).strip()
@@ -192,15 +207,35 @@ class ChatBotGUI:
     def get_bot_response(self, user_message):
         """Получение ответа от бота"""
         try:
-            response = self.giga_client.chat(user_message)
+            response = self.get_client().chat(user_message)
             bot_message = response.choices[0].message.content
             
             # Обновляем UI в главном потоке
-            self.root.after(0, lambda: self.display_response(bot_message))
+            self._ui_queue.put(("bot", bot_message))
             
         except Exception as e:
             error_msg = f"Ошибка: {str(e)}"
-            self.root.after(0, lambda: self.display_error(error_msg))
+            self._ui_queue.put(("error", error_msg))
+    
+    def _drain(self):
+        """Применение всех накопленных обновлений интерфейса за один проход"""
+        try:
+            while True:
+                try:
+                    kind, message = self._ui_queue.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    if kind == "bot":
+                        self.display_response(message)
+                    else:
+                        self.display_error(message)
+                except Exception:
+                    # Ошибка одного обновления не должна останавливать остальные
+                    self.root.report_callback_exception(*sys.exc_info())
+        finally:
+            # Опрос очереди продолжается при любой ошибке, иначе интерфейс перестанет обновляться
+            self.root.after(UI_POLL_MS, self._drain)
     
     def display_response(self, message):
         """Отображение ответа"""
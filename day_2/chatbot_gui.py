@@ -7,7 +7,6 @@ GigaChat AI - Чат-бот с графическим интерфейсом и
 3. Запустите: python chatbot_gui.py
 """
 
-import os
 import json
 import tkinter as tk
 from tkinter import scrolledtext, messagebox
@@ -17,83 +16,28 @@ from typing import Dict, Any
 from dotenv import load_dotenv
 from gigachat import GigaChat
 from gigachat.models import Chat, Messages, MessagesRole
+from gigachat_json_api import (
+    PARSE_RETRY_MESSAGE,
+    STRUCTURE_RETRY_MESSAGE,
+    SYSTEM_MESSAGE,
+    BatchDispatcher,
+    clean_json_response,
+    construct_model,
+    exact_cache,
+    format_json,
+    get_gigachat_client,
+    parse_json,
+    run_coalesced,
+    semantic_cache,
+    stream_json_answer,
+    validate_json_response,
+)
 
 # Загружаем переменные окружения
 load_dotenv()
 
-# Системный промпт для гарантированного JSON-формата
-SYSTEM_PROMPT = """Ты - помощник, который ВСЕГДА отвечает ТОЛЬКО в формате JSON, без дополнительного текста.
 
-КРИТИЧЕСКИ ВАЖНО:
-- Твой ответ должен быть ТОЛЬКО валидным JSON-объектом
-- НЕ добавляй никаких пояснений, комментариев или текста до или после JSON
-- НЕ используй markdown-разметку (не заключай JSON в ```json блоки)
-- Формат ответа ДОЛЖЕН быть строго следующим:
-
-{
-  "answer": "Полный текстовый ответ на вопрос пользователя",
-  "key_points": ["Массив", "с", "ключевыми", "мыслями"],
-  "sentiment": "neutral|positive|negative"
-}
-
-Правила:
-1. "answer" - полный и развернутый ответ на вопрос пользователя
-2. "key_points" - массив строк с ключевыми мыслями из ответа (минимум 3 пункта)
-3. "sentiment" - один из трех вариантов: "neutral", "positive" или "negative"
-
-Пример правильного ответа:
-{"answer": "Искусственный интеллект в медицине...", "key_points": ["Точность диагностики", "Автоматизация процессов", "Персонализированное лечение"], "sentiment": "positive"}
-
-Помни: твой ответ - это ТОЛЬКО JSON, ничего больше!"""
-
-
-def validate_json_response(response_data: Dict[str, Any]) -> bool:
-    """Валидация структуры JSON-ответа"""
-    required_fields = ["answer", "key_points", "sentiment"]
-    
-    if not all(field in response_data for field in required_fields):
-        return False
-    
-    if not isinstance(response_data["answer"], str):
-        return False
-    
-    if not isinstance(response_data["key_points"], list):
-        return False
-    
-    if not all(isinstance(point, str) for point in response_data["key_points"]):
-        return False
-    
-    valid_sentiments = ["neutral", "positive", "negative"]
-    if response_data["sentiment"] not in valid_sentiments:
-        return False
-    
-    return True
-
-
-def clean_json_response(text: str) -> str:
-    """Очистка текста от возможной markdown-разметки и лишнего текста"""
-    text = text.strip()
-    
-    if text.startswith("```json"):
-        text = text[7:]
-    elif text.startswith("```"):
-        text = text[3:]
-    
-    if text.endswith("```"):
-        text = text[:-3]
-    
-    text = text.strip()
-    
-    start_idx = text.find('{')
-    end_idx = text.rfind('}')
-    
-    if start_idx != -1 and end_idx != -1 and end_idx > start_idx:
-        text = text[start_idx:end_idx + 1]
-    
-    return text
-
-
-def send_json_request(client: GigaChat, user_message: str, max_retries: int = 3) -> Dict[str, Any]:
+def send_json_request(client: GigaChat, user_message: str, max_retries: int = 3, on_answer_chunk=None) -> Dict[str, Any]:
     """
     Отправка запроса к GigaChat API с гарантированным JSON-форматом ответа
     
@@ -101,6 +45,8 @@ def send_json_request(client: GigaChat, user_message: str, max_retries: int = 3)
         client: GigaChat клиент
         user_message: Вопрос пользователя
         max_retries: Максимальное количество попыток при ошибках парсинга
+        on_answer_chunk: Если задан, ответ запрашивается потоком, и текст поля answer
+            передается в него по частям (None - сброс показанного текста перед повтором)
         
     Returns:
         Словарь с структурированным ответом
@@ -108,43 +54,55 @@ def send_json_request(client: GigaChat, user_message: str, max_retries: int = 3)
     if not client:
         raise ConnectionError("Клиент GigaChat не инициализирован")
     
+    # Сначала ищем ответ на тот же вопрос в дисковом кеше, затем на похожий - в семантическом
+    cached = exact_cache.get(user_message)
+    if cached is not None:
+        return cached
+    
+    embedding = None
+    if semantic_cache.available:
+        cached, embedding = semantic_cache.lookup(user_message)
+        if cached is not None:
+            return cached
+    
     # Формируем сообщения с системным промптом
-    messages = [
-        Messages(role=MessagesRole.SYSTEM, content=SYSTEM_PROMPT),
-        Messages(role=MessagesRole.USER, content=user_message)
-    ]
+    messages = [SYSTEM_MESSAGE, construct_model(Messages, role=MessagesRole.USER, content=user_message)]
     
-    chat = Chat(messages=messages)
+    chat = construct_model(Chat, messages=messages)
     response_text = None
     
     # Отправляем запрос с повторными попытками
     for attempt in range(max_retries):
         try:
             # Отправляем запрос
-            response = client.chat(chat)
-            response_text = response.choices[0].message.content
+            if on_answer_chunk is None:
+                response = client.chat(chat)
+                response_text = response.choices[0].message.content
+            else:
+                if attempt:
+                    on_answer_chunk(None)
+                response_text = stream_json_answer(client, chat, on_answer_chunk)
             
             # Очищаем ответ от возможных артефактов
             cleaned_text = clean_json_response(response_text)
             
             # Парсим JSON
-            json_data = json.loads(cleaned_text)
+            json_data = parse_json(cleaned_text)
             
             # Валидируем структуру
             if validate_json_response(json_data):
+                exact_cache.put(user_message, json_data)
+                if embedding is not None:
+                    semantic_cache.put(embedding, json_data)
                 return json_data
             else:
                 raise ValueError("Структура JSON не соответствует требованиям")
                 
         except json.JSONDecodeError as e:
             if attempt < max_retries - 1:
-                # Пробуем снова с более строгим промптом
-                retry_prompt = f"{SYSTEM_PROMPT}\n\nВАЖНО: Твой предыдущий ответ был неверным. Отвечай ТОЛЬКО JSON, без дополнительного текста!"
-                messages = [
-                    Messages(role=MessagesRole.SYSTEM, content=retry_prompt),
-                    Messages(role=MessagesRole.USER, content=user_message)
-                ]
-                chat = Chat(messages=messages)
+                # Пробуем снова с замечанием об ошибке
+                messages += [construct_model(Messages, role=MessagesRole.ASSISTANT, content=response_text), PARSE_RETRY_MESSAGE]
+                chat = construct_model(Chat, messages=messages)
             else:
                 raise ValueError(
                     f"Не удалось распарсить JSON после {max_retries} попыток. "
@@ -153,13 +111,9 @@ def send_json_request(client: GigaChat, user_message: str, max_retries: int = 3)
                 )
         except ValueError as e:
             if "Структура JSON" in str(e) and attempt < max_retries - 1:
-                # Пробуем снова с более строгим промптом
-                retry_prompt = f"{SYSTEM_PROMPT}\n\nОШИБКА: Твой ответ не соответствует требуемой структуре. Обязательно используй поля: answer (строка), key_points (массив строк), sentiment (neutral|positive|negative)"
-                messages = [
-                    Messages(role=MessagesRole.SYSTEM, content=retry_prompt),
-                    Messages(role=MessagesRole.USER, content=user_message)
-                ]
-                chat = Chat(messages=messages)
+                # Пробуем снова с замечанием об ошибке
+                messages += [construct_model(Messages, role=MessagesRole.ASSISTANT, content=response_text), STRUCTURE_RETRY_MESSAGE]
+                chat = construct_model(Chat, messages=messages)
             else:
                 raise
     
@@ -176,17 +130,26 @@ class ChatBotGUI:
         # Инициализация GigaChat клиента
         self.giga_client = None
         self.last_json_response = None  # Храним последний JSON-ответ
+        self._answer_streaming = False  # Выводится ли сейчас текст ответа потоком
         self.init_gigachat()
         
+        # Запросы выполняются через диспетчер, который объединяет одновременные вопросы в пачки
+        self._dispatcher = BatchDispatcher(
+            self._request_json,
+            on_batch=lambda batch: semantic_cache.prefetch([args[0] for args in batch])
+        )
+        
+        # Модель семантического кеша загружается в фоне, пока пользователь набирает вопрос
+        Thread(target=semantic_cache.warm_up, daemon=True).start()
+        
         # Создание интерфейса
         self.create_widgets()
         
     def init_gigachat(self):
-        """Инициализация GigaChat клиента"""
-        # Пробуем сначала GIGACHAT_AUTH_DATA, затем GIGACHAT_CREDENTIALS
-        credentials = os.getenv("GIGACHAT_AUTH_DATA") or os.getenv("GIGACHAT_CREDENTIALS")
-        
-        if not credentials:
+        """Инициализация GigaChat клиента (общего с gigachat_json_api)"""
+        try:
+            self.giga_client = get_gigachat_client()
+        except ValueError:
             messagebox.showerror(
                 "Ошибка", 
                 "Не найден ключ авторизации в переменных окружения.\n\n"
@@ -195,17 +158,8 @@ class ChatBotGUI:
                 "или\n"
                 "GIGACHAT_AUTH_DATA=ваш_ключ_авторизации"
             )
-            return
-        
-        try:
-            self.giga_client = GigaChat(
-                credentials=credentials, 
-                verify_ssl_certs=False
-            )
-            self.giga_client.__enter__()
-        except Exception as e:
-            messagebox.showerror("Ошибка подключения", f"Не удалось подключиться к GigaChat API:\n{e}")
-            self.giga_client = None
+        except ConnectionError as e:
+            messagebox.showerror("Ошибка подключения", str(e))
     
     def create_widgets(self):
         """Создание элементов интерфейса"""
@@ -340,29 +294,26 @@ class ChatBotGUI:
     
     def add_json_response(self, json_data: Dict[str, Any]):
         """Добавление структурированного JSON-ответа в чат"""
-        self.chat_display.config(state=tk.NORMAL)
-        
-        # Время
+        # Пары (текст, тег) собираются заранее и вставляются одним вызовом insert
         time_str = datetime.now().strftime("%H:%M")
-        self.chat_display.insert(tk.END, f"[{time_str}] ")
-        self.chat_display.insert(tk.END, "Бот: ", "bot_tag")
-        
-        # Основной ответ
-        self.chat_display.insert(tk.END, f"{json_data['answer']}\n\n")
+        segments = [
+            f"[{time_str}] ", (),
+            "Бот: ", "bot_tag",
+            f"{json_data['answer']}\n\n", (),  # Основной ответ
+        ]
         
-        # Ключевые моменты
+        # Ключевые моменты (подряд идущие строки с одним тегом - одним куском)
         if json_data.get('key_points'):
-            self.chat_display.insert(tk.END, "Ключевые моменты:\n", "bot_tag")
-            for i, point in enumerate(json_data['key_points'], 1):
-                self.chat_display.insert(tk.END, f"  • {point}\n", "key_point_tag")
-            self.chat_display.insert(tk.END, "\n")
+            points = "".join(f"  • {point}\n" for point in json_data['key_points'])
+            segments += ["Ключевые моменты:\n", "bot_tag", points, "key_point_tag", "\n", ()]
         
         # Тональность
         sentiment_text = json_data.get('sentiment', 'neutral')
         sentiment_ru = {"positive": "Положительная", "negative": "Отрицательная", "neutral": "Нейтральная"}.get(sentiment_text, sentiment_text)
-        self.chat_display.insert(tk.END, f"Тональность: ", "bot_tag")
-        self.chat_display.insert(tk.END, f"{sentiment_ru}\n\n", "sentiment_tag")
+        segments += ["Тональность: ", "bot_tag", f"{sentiment_ru}\n\n", "sentiment_tag"]
         
+        self.chat_display.config(state=tk.NORMAL)
+        self.chat_display.insert(tk.END, *segments)
         self.chat_display.config(state=tk.DISABLED)
         self.chat_display.see(tk.END)
     
@@ -392,7 +343,7 @@ class ChatBotGUI:
     def get_bot_response(self, user_message):
         """Получение ответа от бота в JSON-формате"""
         try:
-            json_response = send_json_request(self.giga_client, user_message)
+            json_response = self._dispatcher.submit(user_message).result()
             
             # Обновляем UI в главном потоке
             self.root.after(0, lambda: self.display_json_response(json_response))
@@ -407,8 +358,42 @@ class ChatBotGUI:
             error_msg = f"Произошла ошибка: {str(e)}"
             self.root.after(0, lambda: self.display_error(error_msg))
     
+    def _request_json(self, user_message):
+        """Запрос JSON-ответа (одинаковые одновременные вопросы объединяются)"""
+        return run_coalesced(
+            user_message, send_json_request,
+            self.giga_client, user_message, on_answer_chunk=self._schedule_answer_chunk
+        )
+    
+    def _schedule_answer_chunk(self, chunk):
+        """Передача части ответа из фонового потока в главный"""
+        self.root.after(0, self._append_answer_chunk, chunk)
+    
+    def _append_answer_chunk(self, chunk):
+        """Вывод очередной части ответа (None - удаление выведенного текста)"""
+        self.chat_display.config(state=tk.NORMAL)
+        if chunk is None:
+            if self._answer_streaming:
+                self._answer_streaming = False
+                self.chat_display.delete("answer_start", tk.END)
+        else:
+            if not self._answer_streaming:
+                self._answer_streaming = True
+                # Метка начала потокового ответа остается перед вставляемым текстом
+                self.chat_display.mark_set("answer_start", "end-1c")
+                self.chat_display.mark_gravity("answer_start", tk.LEFT)
+                time_str = datetime.now().strftime("%H:%M")
+                self.chat_display.insert(tk.END, f"[{time_str}] ")
+                self.chat_display.insert(tk.END, "Бот: ", "bot_tag")
+            self.chat_display.insert(tk.END, chunk)
+        self.chat_display.config(state=tk.DISABLED)
+        self.chat_display.see(tk.END)
+    
     def display_json_response(self, json_data: Dict[str, Any]):
         """Отображение структурированного ответа"""
+        # Потоковый черновик заменяется полным разобранным ответом
+        self._append_answer_chunk(None)
+        
         # Сохраняем JSON для показа
         self.last_json_response = json_data
         self.show_json_button.config(state=tk.NORMAL)  # Активируем кнопку
@@ -456,7 +441,7 @@ class ChatBotGUI:
         json_text.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
         
         # Форматируем JSON с отступами
-        formatted_json = json.dumps(self.last_json_response, ensure_ascii=False, indent=2)
+        formatted_json = format_json(self.last_json_response)
         json_text.insert("1.0", formatted_json)
         json_text.config(state=tk.DISABLED)
         
@@ -498,6 +483,7 @@ class ChatBotGUI:
     
     def display_error(self, error_msg):
         """Отображение ошибки"""
+        self._append_answer_chunk(None)
         self.add_message("error", error_msg)
         self.send_button.config(state=tk.NORMAL, text="Отправить")
         self.message_entry.config(state=tk.NORMAL)
@@ -505,11 +491,8 @@ class ChatBotGUI:
     
     def on_closing(self):
         """Обработка закрытия приложения"""
-        if self.giga_client:
-            try:
-                self.giga_client.__exit__(None, None, None)
-            except:
-                pass
+        # Общий клиент GigaChat закрывается при выходе из процесса (atexit)
+        self._dispatcher.close()
         self.root.destroy()
 
 
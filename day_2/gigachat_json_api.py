@@ -3,18 +3,64 @@ GigaChat API - Запросы с гарантированным JSON-форма
 
 Этот модуль предоставляет функцию для отправки запросов к GigaChat API,
 которые гарантированно возвращают ответ в строго заданном JSON-формате.
+
+Семантический кеш ответов (необязательно): pip install numpy sentence-transformers
+Ускорение поиска в большом семантическом кеше (необязательно): pip install numba
+Дисковый кеш точных совпадений (необязательно): pip install diskcache
+Быстрый разбор и проверка JSON (необязательно): pip install orjson fastjsonschema
 """
 
 import os
+import re
 import json
-from typing import Dict, Any, Optional
+import atexit
+import asyncio
+import queue
+import pickle
+import sqlite3
+import logging
+import hashlib
+import threading
+import importlib.util
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Dict, Any, List, Optional, Tuple
 from dotenv import load_dotenv
 from gigachat import GigaChat
-from gigachat.models import Chat, Messages, MessagesRole
+from gigachat.models import Chat, ChatFunctionCall, Function, FunctionParameters, Messages, MessagesRole
+
+try:
+    import numpy as np
+except ImportError:  # Семантический кеш необязателен
+    np = None
+
+# sentence-transformers тянет torch, поэтому импортируется только при загрузке модели
+SEMANTIC_CACHE_AVAILABLE = np is not None and importlib.util.find_spec("sentence_transformers") is not None
+
+# numba импортируется только при первой компиляции ядра поиска (см. _top1_kernel);
+# без numba поиск в кеше идет через умножение матриц NumPy
+NUMBA_AVAILABLE = np is not None and importlib.util.find_spec("numba") is not None
+
+try:
+    import diskcache
+except ImportError:  # Дисковый кеш точных совпадений необязателен
+    diskcache = None
+
+try:
+    import orjson
+except ImportError:  # Без orjson используется стандартный json
+    orjson = None
+
+try:
+    import fastjsonschema
+except ImportError:  # Без fastjsonschema структура проверяется вручную
+    fastjsonschema = None
 
 # Загружаем переменные окружения
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 
 # Системный промпт для гарантированного JSON-формата
 SYSTEM_PROMPT = """Ты - помощник, который ВСЕГДА отвечает ТОЛЬКО в формате JSON, без дополнительного текста.
@@ -41,14 +87,648 @@ SYSTEM_PROMPT = """Ты - помощник, который ВСЕГДА отве
 
 Помни: твой ответ - это ТОЛЬКО JSON, ничего больше!"""
 
+# Сообщения создаются один раз. Системный промпт не меняется между попытками
+# (общий префикс кешируется на стороне сервера), а замечание об ошибке
+# добавляется отдельным сообщением пользователя после неудачного ответа
+SYSTEM_MESSAGE = Messages(role=MessagesRole.SYSTEM, content=SYSTEM_PROMPT)
+PARSE_RETRY_MESSAGE = Messages(
+    role=MessagesRole.USER,
+    content="ВАЖНО: Твой предыдущий ответ был неверным. Отвечай ТОЛЬКО JSON, без дополнительного текста!"
+)
+STRUCTURE_RETRY_MESSAGE = Messages(
+    role=MessagesRole.USER,
+    content="ОШИБКА: Твой ответ не соответствует требуемой структуре. Обязательно используй поля: answer (строка), key_points (массив строк), sentiment (neutral|positive|negative)"
+)
+
+# JSON-схема ответа (та же структура, что описана в SYSTEM_PROMPT)
+RESPONSE_SCHEMA = {
+    "type": "object",
+    "required": ["answer", "key_points", "sentiment"],
+    "properties": {
+        "answer": {"type": "string"},
+        "key_points": {"type": "array", "items": {"type": "string"}},
+        "sentiment": {"enum": ["neutral", "positive", "negative"]},
+    },
+}
+
+# Допустимые значения поля sentiment
+_SENTIMENTS = frozenset(("neutral", "positive", "negative"))
+
+# Скомпилированный валидатор схемы (None, если fastjsonschema не установлен)
+_VALIDATE = fastjsonschema.compile(RESPONSE_SCHEMA) if fastjsonschema is not None else None
+
+# Функция с той же схемой: при ее вызове модель возвращает ответ уже разобранным
+# объектом в аргументах, без markdown и поясняющего текста
+ANSWER_FUNCTION = Function(
+    name="json_answer",
+    description="Структурированный ответ на вопрос пользователя",
+    parameters=FunctionParameters(
+        type="object",
+        properties={
+            "answer": {"type": "string", "description": "Полный текстовый ответ на вопрос"},
+            "key_points": {
+                "type": "array",
+                "items": {"type": "string"},
+                "description": "Ключевые мысли из ответа (минимум 3 пункта)",
+            },
+            "sentiment": {"type": "string", "enum": ["neutral", "positive", "negative"]},
+        },
+        required=["answer", "key_points", "sentiment"],
+    ),
+)
+ANSWER_FUNCTION_CALL = ChatFunctionCall(name=ANSWER_FUNCTION.name)
+
+# JSON-объект целиком, допускаются пробелы и markdown-блок ```json вокруг него
+_JSON_RE = re.compile(r"^\s*(?:```(?:json)?\s*)?(\{.*\})\s*(?:```)?\s*$", re.DOTALL)
+
+# Модель эмбеддингов для семантического кеша (понимает русский язык)
+EMBEDDING_MODEL_NAME = "paraphrase-multilingual-MiniLM-L12-v2"
+
+# Порог косинусного сходства, начиная с которого вопрос считается повтором
+SEMANTIC_CACHE_THRESHOLD = 0.92
+
+# Файл, в котором семантический кеш сохраняется между запусками (журнал записей);
+# у каждой модели эмбеддингов свой файл, так как векторы разных моделей несравнимы
+SEMANTIC_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".semantic_cache.{model}.pkl")
+
+# Максимальное число ответов в семантическом кеше (старые вытесняются)
+SEMANTIC_CACHE_MAX_ENTRIES = 5000
+
+# Сколько заранее найденных результатов поиска хранится до их использования
+SEMANTIC_PREFETCH_MAX = 256
+
+
+# Сколько строк кеша просматривает один поток numba при поиске ближайшего вопроса
+TOP1_CHUNK_ROWS = 1024
+
+# С какого размера кеша ядро numba выгоднее одного умножения матрицы на вектор
+TOP1_MIN_ENTRIES = 2000
+
+
+def _top1_numpy(query, matrix):
+    """Ближайшая строка матрицы к вектору query: (индекс, скалярное произведение)"""
+    scores = matrix @ query
+    best = int(scores.argmax())
+    return best, scores[best]
+
+
+def _compile_top1():
+    """Компиляция numba-версии _top1_numpy (numba импортируется только здесь)"""
+    from numba import njit, prange
+    
+    # Скомпилированный код кешируется на диске и переиспользуется между запусками
+    @njit(parallel=True, fastmath=True, cache=True)
+    def top1(query, matrix):
+        # Скалярные произведения и поиск максимума идут в одном цикле, без массива
+        # оценок размера N; куски строк обрабатываются параллельно
+        rows, dim = matrix.shape
+        chunks = (rows + TOP1_CHUNK_ROWS - 1) // TOP1_CHUNK_ROWS
+        best_scores = np.full(chunks, -np.inf, dtype=np.float32)
+        best_rows = np.zeros(chunks, dtype=np.int64)
+        for chunk in prange(chunks):
+            for row in range(chunk * TOP1_CHUNK_ROWS, min(rows, (chunk + 1) * TOP1_CHUNK_ROWS)):
+                score = 0.0
+                for col in range(dim):
+                    score += query[col] * matrix[row, col]
+                if score > best_scores[chunk]:
+                    best_scores[chunk] = score
+                    best_rows[chunk] = row
+        best = np.argmax(best_scores)
+        return best_rows[best], best_scores[best]
+    
+    return top1
+
+
+_TOP1_KERNEL = None
+_TOP1_LOCK = threading.Lock()
 
-def get_gigachat_client() -> Optional[GigaChat]:
+
+def _top1_kernel():
+    """Ядро поиска ближайшей строки: numba-версия (компилируется при первом вызове) или _top1_numpy без numba"""
+    global _TOP1_KERNEL
+    if _TOP1_KERNEL is None:
+        with _TOP1_LOCK:
+            if _TOP1_KERNEL is None:
+                _TOP1_KERNEL = _compile_top1() if NUMBA_AVAILABLE else _top1_numpy
+    return _TOP1_KERNEL
+
+
+class SemanticCache:
+    """
+    Семантический кеш: вопрос, близкий по смыслу к уже заданному,
+    получает сохраненный проверенный JSON-ответ без запроса к API
     """
-    Инициализация клиента GigaChat API
+    
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        model_name: str = EMBEDDING_MODEL_NAME,
+        max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+    ):
+        self.path = path or SEMANTIC_CACHE_PATH.format(model=re.sub(r"[^\w.-]", "_", model_name))
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._disabled = False  # Модель не загрузилась или запись упала: кеш отключается до перезапуска
+        self._buffer = None  # Матрица (capacity, d) float32 с запасом под новые строки
+        self._embeddings = None  # Заполненная часть буфера: (N, d) нормализованные векторы
+        self._answers = []
+        self._prefetched = {}  # Результаты поиска, заранее посчитанные для пачки вопросов
+        self._loaded = False
+        self._lock = threading.Lock()
+    
+    @property
+    def available(self) -> bool:
+        return SEMANTIC_CACHE_AVAILABLE and not self._disabled
+    
+    def _set_rows(self, rows, answers: List[Dict[str, Any]]):
+        """Замена содержимого кеша (rows - матрица (N, d), N <= max_entries)"""
+        count = len(answers)
+        self._buffer = np.empty((max(count, 16), rows.shape[1]), dtype=np.float32)
+        self._buffer[:count] = rows
+        self._embeddings = self._buffer[:count]
+        self._answers = answers
+    
+    def _match_dimension(self, dimension: int):
+        """Сброс кеша, размерность которого не совпадает с векторами текущей модели"""
+        if self._buffer is None or self._buffer.shape[1] == dimension:
+            return
+        logger.warning(
+            "Семантический кеш %s сброшен: размерность эмбеддингов %d вместо %d",
+            self.path, self._buffer.shape[1], dimension,
+        )
+        self._buffer = self._embeddings = None
+        self._answers = []
+        self._prefetched.clear()
+        self._rewrite()
+    
+    def _disable(self, error: Exception):
+        """Отключение кеша после ошибки (сообщение пишется один раз)"""
+        if not self._disabled:
+            self._disabled = True
+            logger.warning("Семантический кеш отключен: %s", error)
+    
+    def _load(self):
+        """Ленивая загрузка кеша с диска: файл - последовательность записей (эмбеддинг, ответ)"""
+        if self._loaded:
+            return
+        rows, answers = [], []
+        damaged = False
+        try:
+            with open(self.path, "rb") as file:
+                size = os.fstat(file.fileno()).st_size
+                while file.tell() < size:
+                    record = pickle.load(file)
+                    if not isinstance(record, tuple) or len(record) != 2:
+                        raise ValueError("запись кеша не является парой (эмбеддинг, ответ)")
+                    embedding, json_data = record
+                    rows.append(embedding)
+                    answers.append(json_data)
+        except OSError:
+            pass  # Файла еще нет или он недоступен: кеш начинается с пустого
+        except (EOFError, pickle.UnpicklingError, AttributeError, ImportError, ValueError, TypeError):
+            damaged = True  # Недописанный или чужой хвост файла отбрасывается, прочитанное остается
+        
+        # Записи другой размерности (файл дописывала другая модель) не сравнимы с остальными
+        if rows:
+            shape = np.shape(rows[-1])
+            kept = [index for index, row in enumerate(rows) if np.shape(row) == shape]
+            if len(kept) < len(rows):
+                rows, answers = [rows[index] for index in kept], [answers[index] for index in kept]
+                damaged = True
+        
+        total = len(answers)
+        rows, answers = rows[-self.max_entries:], answers[-self.max_entries:]
+        if answers:
+            self._set_rows(np.asarray(rows, dtype=np.float32), answers)
+        # Лишние старые или поврежденные записи убираются перезаписью файла,
+        # чтобы новые записи дописывались после целых
+        if damaged or total > len(answers):
+            self._rewrite()
+        self._loaded = True
+    
+    def _rewrite(self):
+        """Полная перезапись файла текущим содержимым кеша"""
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "wb") as file:
+                if self._answers:
+                    for embedding, json_data in zip(self._embeddings, self._answers):
+                        pickle.dump((embedding, json_data), file)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+    
+    def _append(self, embedding, json_data: Dict[str, Any]):
+        """Дозапись одной записи в конец файла (без перезаписи всего кеша)"""
+        try:
+            with open(self.path, "ab") as file:
+                pickle.dump((embedding, json_data), file)
+        except OSError:
+            pass
+    
+    def _get_model(self):
+        """Общая модель эмбеддингов: загружается один раз и сразу прогревается"""
+        with self._model_lock:
+            if self._model is None:
+                try:
+                    from sentence_transformers import SentenceTransformer
+                    
+                    model = SentenceTransformer(self.model_name, device="cpu")
+                    model.encode(["warmup"], show_progress_bar=False)
+                except Exception:
+                    self._disabled = True
+                    raise
+                self._model = model
+            return self._model
+    
+    def warm_up(self):
+        """Заблаговременная загрузка модели (удобно вызывать в фоновом потоке при старте)"""
+        if self.available:
+            try:
+                self._get_model()
+            except Exception:
+                return  # Кеш отключен, вопросы идут напрямую в API
+            # Ядро numba (parallel=True) тоже компилируется заранее, а не в первом запросе;
+            # специализация зависит только от типов массивов, не от их размера
+            if NUMBA_AVAILABLE:
+                try:
+                    _top1_kernel()(np.zeros(1, dtype=np.float32), np.zeros((1, 1), dtype=np.float32))
+                except Exception:
+                    pass
+    
+    def embed_many(self, texts: List[str]):
+        """Нормализованные эмбеддинги текстов одним прогоном модели: матрица (K, d)"""
+        vectors = self._get_model().encode(
+            texts,
+            batch_size=max(len(texts), 1),
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False,
+        )
+        return vectors.astype(np.float32, copy=False)
+    
+    def embed(self, text: str):
+        """Нормализованный эмбеддинг текста"""
+        return self.embed_many([text])[0]
+    
+    def lookup_many(self, user_messages: List[str], threshold: float = SEMANTIC_CACHE_THRESHOLD) -> List[Tuple[Optional[Dict[str, Any]], Any]]:
+        """Поиск для пачки вопросов: один прогон модели и одно матричное умножение"""
+        embeddings = self.embed_many(user_messages)
+        with self._lock:
+            self._load()
+            self._match_dimension(embeddings.shape[-1])
+            if self._embeddings is None or not self._answers:
+                return [(None, embedding) for embedding in embeddings]
+            # Векторы нормализованы, поэтому скалярное произведение равно косинусу
+            if len(embeddings) == 1:
+                kernel = _top1_kernel() if len(self._answers) >= TOP1_MIN_ENTRIES else _top1_numpy
+                index, score = kernel(embeddings[0], self._embeddings)
+                cached = self._answers[index] if score >= threshold else None
+                return [(cached, embeddings[0])]
+            scores = embeddings @ self._embeddings.T
+            best = scores.argmax(axis=1)
+            return [
+                (self._answers[index] if scores[row, index] >= threshold else None, embeddings[row])
+                for row, index in enumerate(best)
+            ]
+    
+    def prefetch(self, user_messages: List[str]):
+        """Заранее выполнить поиск для пачки вопросов; lookup затем берет готовый результат"""
+        if not self.available:
+            return
+        user_messages = list(dict.fromkeys(user_messages))
+        results = self.lookup_many(user_messages) if user_messages else []
+        with self._lock:
+            self._prefetched.update(zip(user_messages, results))
+            # Пачки выполняются одновременно, поэтому словарь пополняется; невостребованные
+            # (запрос упал до поиска в кеше) старые результаты вытесняются
+            while len(self._prefetched) > SEMANTIC_PREFETCH_MAX:
+                del self._prefetched[next(iter(self._prefetched))]
+    
+    def lookup(self, user_message: str, threshold: float = SEMANTIC_CACHE_THRESHOLD) -> Tuple[Optional[Dict[str, Any]], Any]:
+        """
+        Поиск ответа на похожий вопрос
+        
+        Кеш необязателен: при сбое модели возвращается (None, None),
+        и вопрос уходит в API как обычно.
+        
+        Returns:
+            (сохраненный ответ или None, эмбеддинг вопроса для последующего put)
+        """
+        with self._lock:
+            prefetched = self._prefetched.pop(user_message, None)
+        if prefetched is not None:
+            return prefetched
+        try:
+            return self.lookup_many([user_message], threshold)[0]
+        except Exception:
+            return None, None
+    
+    def put(self, embedding, json_data: Dict[str, Any]):
+        """
+        Сохранение проверенного ответа (амортизированно O(1): буфер с запасом и дозапись в файл)
+        
+        Кеш необязателен: при ошибке записи он отключается, а ответ
+        все равно возвращается пользователю.
+        """
+        if not self.available:
+            return
+        with self._lock:
+            try:
+                self._put(embedding, json_data)
+            except Exception as e:
+                self._disable(e)
+    
+    def _put(self, embedding, json_data: Dict[str, Any]):
+        """Запись в кеш (вызывается под self._lock)"""
+        self._load()
+        self._match_dimension(embedding.shape[-1])
+        count = len(self._answers)
+        if self._buffer is None:
+            self._set_rows(embedding.reshape(1, -1), [json_data])
+            self._append(embedding, json_data)
+            return
+        
+        if count >= self.max_entries:
+            # Вытесняем самую старую десятую часть и сжимаем файл (раз в max_entries / 10 записей)
+            drop = max(1, self.max_entries // 10)
+            self._set_rows(self._embeddings[drop:], self._answers[drop:])
+            count -= drop
+            evicted = True
+        else:
+            evicted = False
+        
+        if count == len(self._buffer):
+            grown = np.empty((min(2 * count, self.max_entries), self._buffer.shape[1]), dtype=np.float32)
+            grown[:count] = self._embeddings
+            self._buffer = grown
+        self._buffer[count] = embedding
+        self._embeddings = self._buffer[:count + 1]
+        self._answers.append(json_data)
+        
+        if evicted:
+            self._rewrite()
+        else:
+            self._append(embedding, json_data)
+
+
+# Общий кеш для консольного API и графического интерфейса
+semantic_cache = SemanticCache()
+
+
+# Каталог дискового кеша точных совпадений и срок хранения ответа в нем (секунды)
+EXACT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".gigachat_cache")
+EXACT_CACHE_TTL = 30 * 86400
+
+
+class ExactCache:
+    """
+    Дисковый кеш точных совпадений: тот же вопрос при том же системном
+    промпте сразу получает проверенный ответ, в том числе после перезапуска
+    
+    Кеш необязателен: при ошибке диска или SQLite он отключается до перезапуска,
+    а запросы идут в API как обычно.
+    """
+    
+    def __init__(self, directory: str = EXACT_CACHE_DIR, ttl: int = EXACT_CACHE_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        self._cache = None
+        self._disabled = False
+        self._lock = threading.Lock()
+    
+    @property
+    def available(self) -> bool:
+        return diskcache is not None and not self._disabled
+    
+    def _open(self):
+        """Ленивое открытие кеша (diskcache потокобезопасен, открывается один раз)"""
+        with self._lock:
+            if self._cache is None:
+                self._cache = diskcache.Cache(self.directory)
+            return self._cache
+    
+    def _disable(self, error: Exception):
+        """Отключение кеша после ошибки (сообщение пишется один раз)"""
+        with self._lock:
+            if self._disabled:
+                return
+            self._disabled = True
+        logger.warning("Дисковый кеш ответов отключен (%s): %s", self.directory, error)
+    
+    @staticmethod
+    def key(user_message: str) -> str:
+        """Ключ ответа: хеш системного промпта и вопроса"""
+        return hashlib.blake2b(f"{SYSTEM_PROMPT}|{user_message}".encode()).hexdigest()
+    
+    def get(self, user_message: str) -> Optional[Dict[str, Any]]:
+        """Сохраненный ответ на точно такой же вопрос (None, если его нет или кеш недоступен)"""
+        if not self.available:
+            return None
+        try:
+            return self._open().get(self.key(user_message))
+        except (OSError, sqlite3.Error, diskcache.Timeout, pickle.PickleError) as e:
+            self._disable(e)
+            return None
+    
+    def put(self, user_message: str, json_data: Dict[str, Any]):
+        """Сохранение проверенного ответа (ошибка диска отключает кеш, но не запрос)"""
+        if not self.available:
+            return
+        try:
+            self._open().set(self.key(user_message), json_data, expire=self.ttl)
+        except (OSError, sqlite3.Error, diskcache.Timeout, pickle.PickleError) as e:
+            self._disable(e)
+
+
+# Общий дисковый кеш для консольного API и графического интерфейса
+exact_cache = ExactCache()
+
+
+# Сколько вопросов выполняется одной пачкой
+BATCH_SIZE = 8
+
+
+class BatchDispatcher:
+    """
+    Диспетчер запросов: вопросы, пришедшие почти одновременно,
+    собираются в пачку и выполняются параллельно в пуле потоков
+    """
+    
+    def __init__(self, handler, batch_size: int = BATCH_SIZE, on_batch=None):
+        self.handler = handler
+        self.on_batch = on_batch  # Вызывается со списком аргументов пачки перед ее выполнением
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=batch_size)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    
+    def submit(self, *args, **kwargs) -> Future:
+        """Постановка запроса в очередь; результат handler(*args, **kwargs) придет во Future"""
+        future = Future()
+        self._queue.put((future, args, kwargs))
+        return future
+    
+    def close(self):
+        """Остановка диспетчера после уже поставленных запросов"""
+        self._queue.put(None)
+    
+    def _collect(self):
+        """
+        Ожидание первого запроса и добор пачки из уже стоящих в очереди
+        
+        Дополнительного ожидания нет: одиночный вопрос выполняется сразу,
+        а пачка собирается только из запросов, пришедших одновременно.
+        """
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        while len(batch) < self.batch_size:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+    
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                self._executor.shutdown(wait=False)
+                return
+            
+            # Общая подготовка пачки (например, поиск в кеше сразу для всех вопросов)
+            if self.on_batch is not None:
+                try:
+                    self.on_batch([args for _, args, _ in batch])
+                except Exception:
+                    pass
+            
+            # Запросы уходят в пул, а диспетчер сразу возвращается к очереди: результаты
+            # передаются вызывающим по завершении, параллельность ограничена размером пула
+            for future, args, kwargs in batch:
+                running = self._executor.submit(self.handler, *args, **kwargs)
+                running.add_done_callback(partial(self._resolve, future))
+    
+    @staticmethod
+    def _resolve(future: Future, done: Future):
+        """Передача результата (или исключения) выполненного запроса вызывающему"""
+        error = done.exception()
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(done.result())
+
+
+# Запросы, выполняющиеся сейчас: ключ вопроса -> Future с его результатом
+_INFLIGHT: Dict[str, Future] = {}
+_INFLIGHT_LOCK = threading.Lock()
+
+
+def _join_inflight(user_message: str) -> Tuple[str, Future, bool]:
+    """Ключ вопроса, его Future и признак того, что запрос выполняет этот вызов"""
+    key = hashlib.blake2b(user_message.encode(), digest_size=16).hexdigest()
+    
+    with _INFLIGHT_LOCK:
+        future = _INFLIGHT.get(key)
+        owner = future is None
+        if owner:
+            future = _INFLIGHT[key] = Future()
+    return key, future, owner
+
+
+def run_coalesced(user_message: str, func, *args, **kwargs):
+    """
+    Выполнение func(*args, **kwargs) с объединением одинаковых одновременных вопросов
+    
+    Если такой же вопрос уже выполняется, второй вызов не отправляет запрос,
+    а дожидается результата (или исключения) первого.
+    """
+    key, future, owner = _join_inflight(user_message)
+    
+    if not owner:
+        return future.result()
+    
+    try:
+        result = func(*args, **kwargs)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        with _INFLIGHT_LOCK:
+            del _INFLIGHT[key]
+
+
+async def run_coalesced_async(user_message: str, func, *args, **kwargs):
+    """
+    Асинхронный run_coalesced: func - корутинная функция
+    
+    Карта выполняющихся вопросов общая с run_coalesced, поэтому одинаковые
+    вопросы объединяются и между синхронными и асинхронными вызовами.
+    """
+    key, future, owner = _join_inflight(user_message)
+    
+    if not owner:
+        return await asyncio.wrap_future(future)
+    
+    try:
+        result = await func(*args, **kwargs)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        with _INFLIGHT_LOCK:
+            del _INFLIGHT[key]
+
+
+# Общий клиент GigaChat: токен и TLS-соединение переиспользуются между запросами
+_CLIENT: Optional[GigaChat] = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_gigachat_client() -> GigaChat:
+    """
+    Клиент GigaChat API (создается при первом вызове и закрывается при выходе)
     
     Returns:
-        GigaChat клиент или None в случае ошибки
+        GigaChat клиент
+        
+    Raises:
+        ValueError: Если не найден ключ авторизации
+        ConnectionError: Если не удалось подключиться к API
     """
+    global _CLIENT
+    
+    if _CLIENT is not None:
+        return _CLIENT
+    
+    with _CLIENT_LOCK:
+        if _CLIENT is not None:
+            return _CLIENT
+        
+        client = _create_gigachat_client()
+        client.__enter__()
+        atexit.register(client.__exit__, None, None, None)
+        _CLIENT = client
+        return client
+
+
+def _create_gigachat_client() -> GigaChat:
+    """Новый клиент GigaChat с ключом из переменных окружения"""
     # Пробуем сначала GIGACHAT_AUTH_DATA, затем GIGACHAT_CREDENTIALS
     credentials = os.getenv("GIGACHAT_AUTH_DATA") or os.getenv("GIGACHAT_CREDENTIALS")
     
@@ -59,16 +739,51 @@ def get_gigachat_client() -> Optional[GigaChat]:
         )
     
     try:
-        client = GigaChat(
+        return GigaChat(
             credentials=credentials,
             verify_ssl_certs=False
         )
-        client.__enter__()
-        return client
     except Exception as e:
         raise ConnectionError(f"Не удалось подключиться к GigaChat API: {e}")
 
 
+# Клиенты для асинхронных запросов: httpx.AsyncClient внутри SDK привязан к циклу
+# событий, в котором создан, поэтому у каждого цикла свой клиент
+_ASYNC_CLIENTS: Dict[asyncio.AbstractEventLoop, GigaChat] = {}
+
+
+def get_gigachat_async_client() -> GigaChat:
+    """
+    Клиент GigaChat для текущего цикла событий (вызывается из корутины)
+    
+    Raises:
+        ValueError: Если не найден ключ авторизации
+        ConnectionError: Если не удалось подключиться к API
+    """
+    loop = asyncio.get_running_loop()
+    client = _ASYNC_CLIENTS.get(loop)
+    if client is None:
+        # Клиенты завершенных без aclose_gigachat_client циклов больше не нужны
+        for closed in [other for other in _ASYNC_CLIENTS if other.is_closed()]:
+            del _ASYNC_CLIENTS[closed]
+        client = _ASYNC_CLIENTS[loop] = _create_gigachat_client()
+    return client
+
+
+async def aclose_gigachat_client():
+    """
+    Закрытие клиента текущего цикла событий
+    
+    Асинхронный httpx-клиент можно закрыть только в том цикле, в котором он
+    работал, поэтому atexit тут не подходит. Пользователи send_json_request_async
+    вызывают эту функцию перед завершением своего цикла (например, в конце
+    корутины для asyncio.run); следующий цикл получит новый клиент.
+    """
+    client = _ASYNC_CLIENTS.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.__aexit__(None, None, None)
+
+
 def validate_json_response(response_data: Dict[str, Any]) -> bool:
     """
     Валидация структуры JSON-ответа
@@ -79,28 +794,80 @@ def validate_json_response(response_data: Dict[str, Any]) -> bool:
     Returns:
         True если структура корректна, иначе False
     """
-    required_fields = ["answer", "key_points", "sentiment"]
+    if _VALIDATE is not None:
+        try:
+            _VALIDATE(response_data)
+        except fastjsonschema.JsonSchemaException:
+            return False
+        return True
     
-    # Проверяем наличие всех обязательных полей
-    if not all(field in response_data for field in required_fields):
+    # Ответ разобран из JSON, поэтому достаточно точных проверок type(...) is ...;
+    # отсутствующее поле дает None и отсекается той же проверкой
+    if type(response_data) is not dict:
         return False
     
-    # Проверяем типы данных
-    if not isinstance(response_data["answer"], str):
+    if type(response_data.get("answer")) is not str:
         return False
     
-    if not isinstance(response_data["key_points"], list):
+    key_points = response_data.get("key_points")
+    if type(key_points) is not list:
         return False
     
-    if not all(isinstance(point, str) for point in response_data["key_points"]):
-        return False
+    for point in key_points:
+        if type(point) is not str:
+            return False
     
-    # Проверяем sentiment
-    valid_sentiments = ["neutral", "positive", "negative"]
-    if response_data["sentiment"] not in valid_sentiments:
-        return False
-    
-    return True
+    sentiment = response_data.get("sentiment")
+    return type(sentiment) is str and sentiment in _SENTIMENTS
+
+
+def parse_json(text: str) -> Any:
+    """Разбор JSON (orjson, если установлен); ошибка - json.JSONDecodeError"""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def format_json(data: Any) -> str:
+    """JSON с отступом в 2 пробела и без экранирования кириллицы (orjson, если установлен)"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(data, ensure_ascii=False, indent=2)
+
+
+def construct_model(model_cls, **fields):
+    """Создание модели gigachat без валидации (поля заполняются проверенными данными)"""
+    construct = getattr(model_cls, "model_construct", None) or model_cls.construct
+    return construct(**fields)
+
+
+def answer_chat(messages) -> Chat:
+    """Запрос, в котором модель обязана ответить вызовом функции ответа"""
+    return construct_model(Chat, messages=messages, functions=[ANSWER_FUNCTION], function_call=ANSWER_FUNCTION_CALL)
+
+
+def function_arguments(message) -> Optional[Dict[str, Any]]:
+    """Аргументы вызова функции ответа (None, если модель ответила текстом)"""
+    function_call = getattr(message, "function_call", None)
+    if function_call is not None and isinstance(function_call.arguments, dict):
+        return function_call.arguments
+    return None
+
+
+def reply_text(message) -> str:
+    """Текст ответа модели для сообщений об ошибке и повторной попытки"""
+    arguments = function_arguments(message)
+    if arguments is not None and not message.content:
+        return json.dumps(arguments, ensure_ascii=False)
+    return message.content or ""
+
+
+def parse_reply(message) -> Any:
+    """JSON-данные ответа: аргументы вызова функции или разобранный текст сообщения"""
+    json_data = function_arguments(message)
+    if json_data is None:
+        json_data = parse_json(clean_json_response(reply_text(message)))
+    return json_data
 
 
 def clean_json_response(text: str) -> str:
@@ -113,29 +880,140 @@ def clean_json_response(text: str) -> str:
     Returns:
         Очищенный JSON-текст
     """
-    # Убираем markdown-блоки кода
-    text = text.strip()
+    # Обычный случай: JSON-объект, возможно в блоке ```json ... ```, за один проход
+    match = _JSON_RE.match(text)
+    if match:
+        return match.group(1)
+    
+    # Иначе ищем первую { и последнюю } (после нее, текст до { не просматривается повторно)
+    start_idx = text.find('{')
+    if start_idx == -1:
+        return text.strip()
+    end_idx = text.rfind('}', start_idx)
+    
+    if end_idx > start_idx:
+        return text[start_idx:end_idx + 1]
     
-    # Убираем ```json и ``` в начале и конце
-    if text.startswith("```json"):
-        text = text[7:]
-    elif text.startswith("```"):
-        text = text[3:]
+    return text.strip()
+
+
+# Начало строкового значения поля answer в потоке JSON
+_ANSWER_START_RE = re.compile(r'"answer"\s*:\s*"')
+
+# Однобуквенные escape-последовательности JSON
+_JSON_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class AnswerStreamExtractor:
+    """Извлечение текста поля answer из JSON, который приходит по частям"""
     
-    if text.endswith("```"):
-        text = text[:-3]
+    def __init__(self):
+        self._buffer = ""
+        self._pos = None  # Начало еще не разобранной части строки answer
+        self.done = False
     
-    text = text.strip()
+    def feed(self, delta: str) -> str:
+        """Добавление очередной части JSON; возвращает новый раскодированный текст answer"""
+        if self.done:
+            return ""
+        self._buffer += delta
+        buf = self._buffer
+        
+        if self._pos is None:
+            match = _ANSWER_START_RE.search(buf)
+            if match is None:
+                return ""
+            self._pos = match.end()
+        
+        out = []
+        i = self._pos
+        n = len(buf)
+        while i < n:
+            ch = buf[i]
+            if ch == '"':
+                self.done = True
+                break
+            if ch != "\\":
+                j = i
+                while j < n and buf[j] != '"' and buf[j] != "\\":
+                    j += 1
+                out.append(buf[i:j])
+                i = j
+                continue
+            
+            # Escape-последовательность: ждем, пока она придет целиком
+            if i + 1 >= n:
+                break
+            code = buf[i + 1]
+            if code == "u":
+                end = i + 6
+                if buf[i + 2:i + 4].lower() in ("d8", "d9", "da", "db"):
+                    end = i + 12  # Суррогатная пара
+                if end > n:
+                    break
+                try:
+                    out.append(json.loads(f'"{buf[i:end]}"'))
+                except ValueError:
+                    self.done = True
+                    break
+                i = end
+                continue
+            out.append(_JSON_ESCAPES.get(code, code))
+            i += 2
+        
+        self._pos = i
+        return "".join(out)
+
+
+def stream_json_answer(client: GigaChat, chat: Chat, on_answer_chunk) -> str:
+    """
+    Потоковый запрос к GigaChat API
     
-    # Пытаемся найти JSON объект в тексте
-    # Ищем первую { и последнюю }
-    start_idx = text.find('{')
-    end_idx = text.rfind('}')
+    Args:
+        client: GigaChat клиент
+        chat: Запрос
+        on_answer_chunk: Вызывается с каждой новой частью текста поля answer
+        
+    Returns:
+        Полный текст ответа модели
+    """
+    extractor = AnswerStreamExtractor()
+    parts = []
+    for chunk in client.stream(chat):
+        delta = chunk.choices[0].delta.content
+        if not delta:
+            continue
+        parts.append(delta)
+        text = extractor.feed(delta)
+        if text:
+            on_answer_chunk(text)
+    return "".join(parts)
+
+
+def _check_reply(message, max_retries: int) -> Tuple[Optional[Dict[str, Any]], Optional[Messages], str]:
+    """
+    Разбор и проверка одного ответа модели
     
-    if start_idx != -1 and end_idx != -1 and end_idx > start_idx:
-        text = text[start_idx:end_idx + 1]
+    Returns:
+        (json_data, None, "") для валидного ответа, иначе
+        (None, замечание для следующей попытки, текст ошибки)
+    """
+    try:
+        # Ответ вызовом функции уже разобран, иначе разбираем текст
+        json_data = parse_reply(message)
+    except json.JSONDecodeError as e:
+        return None, PARSE_RETRY_MESSAGE, (
+            f"Не удалось распарсить JSON после {max_retries} попыток. "
+            f"Ответ от API: {reply_text(message)[:200]}... "
+            f"Ошибка парсинга: {e}"
+        )
     
-    return text
+    if validate_json_response(json_data):
+        return json_data, None, ""
+    return None, STRUCTURE_RETRY_MESSAGE, (
+        f"Не удалось получить валидный JSON после {max_retries} попыток. "
+        "Ошибка валидации: Структура JSON не соответствует требованиям"
+    )
 
 
 def send_json_request(user_message: str, max_retries: int = 3) -> Dict[str, Any]:
@@ -158,87 +1036,110 @@ def send_json_request(user_message: str, max_retries: int = 3) -> Dict[str, Any]
         ValueError: Если не удалось получить валидный JSON после всех попыток
         ConnectionError: Если не удалось подключиться к API
     """
-    client = None
+    # Одинаковые одновременные вопросы выполняются одним запросом
+    return run_coalesced(user_message, _send_json_request, user_message, max_retries)
+
+
+def _send_json_request(user_message: str, max_retries: int) -> Dict[str, Any]:
+    """Запрос к GigaChat API с повторными попытками (см. send_json_request)"""
+    # Сначала ищем ответ на тот же вопрос в дисковом кеше, затем на похожий - в семантическом
+    cached = exact_cache.get(user_message)
+    if cached is not None:
+        return cached
     
-    try:
-        client = get_gigachat_client()
-        
-        if not client:
-            raise ConnectionError("Не удалось инициализировать клиент GigaChat")
-        
-        # Формируем сообщения с системным промптом
-        messages = [
-            Messages(role=MessagesRole.SYSTEM, content=SYSTEM_PROMPT),
-            Messages(role=MessagesRole.USER, content=user_message)
-        ]
-        
-        chat = Chat(messages=messages)
+    embedding = None
+    if semantic_cache.available:
+        cached, embedding = semantic_cache.lookup(user_message)
+        if cached is not None:
+            return cached
+    
+    client = get_gigachat_client()
+    
+    # Формируем сообщения с системным промптом
+    messages = [SYSTEM_MESSAGE, construct_model(Messages, role=MessagesRole.USER, content=user_message)]
+    error = "Не удалось получить валидный ответ"
+    attempts_left = max_retries
+    
+    # Каждая попытка - один запрос и один разбор ответа
+    while attempts_left:
+        message = client.chat(answer_chat(messages)).choices[0].message
+        json_data, retry_message, error = _check_reply(message, max_retries)
+        if json_data is not None:
+            _remember_answer(user_message, embedding, json_data)
+            return json_data
         
-        # Отправляем запрос
-        response = client.chat(chat)
-        response_text = response.choices[0].message.content
+        attempts_left -= 1
+        if attempts_left:
+            # Следующая попытка с замечанием об ошибке
+            messages += [construct_model(Messages, role=MessagesRole.ASSISTANT, content=reply_text(message)), retry_message]
+    
+    raise ValueError(error)
+
+
+def _remember_answer(user_message: str, embedding, json_data: Dict[str, Any]):
+    """Сохранение проверенного ответа в дисковый и семантический кеши"""
+    exact_cache.put(user_message, json_data)
+    if embedding is not None:
+        semantic_cache.put(embedding, json_data)
+
+
+async def send_json_request_async(user_message: str, max_retries: int = 3) -> Dict[str, Any]:
+    """
+    Асинхронный вариант send_json_request
+    
+    Запросы идут через client.achat клиента текущего цикла событий
+    (get_gigachat_async_client): SDK держит для него собственный
+    httpx.AsyncClient с пулом соединений по умолчанию, поэтому много вопросов
+    можно вести в одном цикле, не занимая по потоку на каждый. Обращения
+    к кешам (SQLite, модель эмбеддингов) выполняются в потоках и не блокируют
+    цикл. Одинаковые одновременные вопросы объединяются с синхронными
+    (run_coalesced_async). По завершении работы вызовите aclose_gigachat_client.
+    
+    Args:
+        user_message: Вопрос пользователя
+        max_retries: Максимальное количество попыток при ошибках парсинга
         
-        # Пытаемся распарсить JSON
-        for attempt in range(max_retries):
-            try:
-                # Очищаем ответ от возможных артефактов
-                cleaned_text = clean_json_response(response_text)
-                
-                # Парсим JSON
-                json_data = json.loads(cleaned_text)
-                
-                # Валидируем структуру
-                if validate_json_response(json_data):
-                    return json_data
-                else:
-                    raise ValueError("Структура JSON не соответствует требованиям")
-                    
-            except json.JSONDecodeError as e:
-                if attempt < max_retries - 1:
-                    # Если не получилось распарсить, пробуем снова с более строгим промптом
-                    retry_prompt = f"{SYSTEM_PROMPT}\n\nВАЖНО: Твой предыдущий ответ был неверным. Отвечай ТОЛЬКО JSON, без дополнительного текста!"
-                    messages = [
-                        Messages(role=MessagesRole.SYSTEM, content=retry_prompt),
-                        Messages(role=MessagesRole.USER, content=user_message)
-                    ]
-                    chat = Chat(messages=messages)
-                    response = client.chat(chat)
-                    response_text = response.choices[0].message.content
-                else:
-                    raise ValueError(
-                        f"Не удалось распарсить JSON после {max_retries} попыток. "
-                        f"Ответ от API: {response_text[:200]}... "
-                        f"Ошибка парсинга: {e}"
-                    )
-            except ValueError as e:
-                if attempt < max_retries - 1:
-                    # Пробуем снова с более строгим промптом
-                    retry_prompt = f"{SYSTEM_PROMPT}\n\nОШИБКА: Твой ответ не соответствует требуемой структуре. Обязательно используй поля: answer (строка), key_points (массив строк), sentiment (neutral|positive|negative)"
-                    messages = [
-                        Messages(role=MessagesRole.SYSTEM, content=retry_prompt),
-                        Messages(role=MessagesRole.USER, content=user_message)
-                    ]
-                    chat = Chat(messages=messages)
-                    response = client.chat(chat)
-                    response_text = response.choices[0].message.content
-                else:
-                    raise ValueError(
-                        f"Не удалось получить валидный JSON после {max_retries} попыток. "
-                        f"Ошибка валидации: {e}"
-                    )
+    Returns:
+        Словарь с структурированным ответом (как у send_json_request)
         
-        # Этот код не должен выполниться, но на всякий случай
-        raise ValueError("Не удалось получить валидный ответ")
+    Raises:
+        ValueError: Если не удалось получить валидный JSON после всех попыток
+        ConnectionError: Если не удалось подключиться к API
+    """
+    return await run_coalesced_async(user_message, _send_json_request_async, user_message, max_retries)
+
+
+async def _send_json_request_async(user_message: str, max_retries: int) -> Dict[str, Any]:
+    """Асинхронный запрос к GigaChat API с повторными попытками (см. send_json_request_async)"""
+    cached = await asyncio.to_thread(exact_cache.get, user_message)
+    if cached is not None:
+        return cached
+    
+    embedding = None
+    if semantic_cache.available:
+        cached, embedding = await asyncio.to_thread(semantic_cache.lookup, user_message)
+        if cached is not None:
+            return cached
+    
+    client = get_gigachat_async_client()
+    messages = [SYSTEM_MESSAGE, construct_model(Messages, role=MessagesRole.USER, content=user_message)]
+    error = "Не удалось получить валидный ответ"
+    attempts_left = max_retries
+    
+    # Каждая попытка - один запрос и один разбор ответа
+    while attempts_left:
+        message = (await client.achat(answer_chat(messages))).choices[0].message
+        json_data, retry_message, error = _check_reply(message, max_retries)
+        if json_data is not None:
+            await asyncio.to_thread(_remember_answer, user_message, embedding, json_data)
+            return json_data
         
-    except Exception as e:
-        raise
-    finally:
-        # Закрываем соединение
-        if client:
-            try:
-                client.__exit__(None, None, None)
-            except:
-                pass
+        attempts_left -= 1
+        if attempts_left:
+            # Следующая попытка с замечанием об ошибке
+            messages += [construct_model(Messages, role=MessagesRole.ASSISTANT, content=reply_text(message)), retry_message]
+    
+    raise ValueError(error)
 
 
 def main():
@@ -262,7 +1163,7 @@ def main():
         print("\n" + "=" * 60)
         print("РЕЗУЛЬТАТ:")
         print("=" * 60)
-        print(json.dumps(result, ensure_ascii=False, indent=2))
+        print(format_json(result))
         
         print("\n" + "=" * 60)
         print("РАСШИФРОВКА:")